@@ -2,13 +2,60 @@ import xml.etree.ElementTree as ET
 import os
 import plistlib
 
+class CatalogDevice(dict):
+    """A machine's device entry whose slot tree lives in the shared device
+    catalog (mkmachines.py --catalog).  The catalog entry is loaded the first
+    time the device's contents are looked at."""
+
+    def __init__(self, entry, loader):
+        super().__init__(entry)
+        self._loader = loader
+
+    def _resolve(self):
+        key = dict.pop(self, 'catalog', None)
+        if key is not None:
+            entry = self._loader(key)
+            if entry:
+                self.update(entry)
+
+    def __getitem__(self, key):
+        if key != 'name': self._resolve()
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        if key != 'name': self._resolve()
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        if key != 'name': self._resolve()
+        return super().__contains__(key)
+
+    def __iter__(self):
+        self._resolve()
+        return super().__iter__()
+
+    def keys(self):
+        self._resolve()
+        return super().keys()
+
+    def items(self):
+        self._resolve()
+        return super().items()
+
+    def values(self):
+        self._resolve()
+        return super().values()
+
+
 class DataManager:
     def __init__(self, resources_path, hash_path=None):
         self.resources_path = resources_path
         self.hash_path = hash_path
         self.models = self.load_plist('models.plist')
         self.roms = self.load_plist('roms.plist')
+        self.extensions = self.load_plist('extensions.plist') or {}
         self.machine_cache = {}
+        self.catalog_cache = {}
         self.software_cache = {}
 
     def load_plist(self, filename):
@@ -25,9 +72,31 @@ class DataManager:
         
         desc = self.load_plist(f'{machine_name}.plist')
         if desc:
+            devices = desc.get('devices')
+            if devices:
+                desc['devices'] = [
+                    CatalogDevice(d, self.get_catalog_entry) if 'catalog' in d else d
+                    for d in devices
+                ]
             self.machine_cache[machine_name] = desc
         return desc
 
+    def get_media_extensions(self, machine_name, media):
+        # File extensions a machine accepts for a media type ('cass',
+        # 'floppy_5_25', ...). Older resources have no per-machine list;
+        # fall back to the global extension index.
+        desc = self.get_machine_description(machine_name)
+        if desc and 'extensions' in desc:
+            return desc['extensions'].get(media, [])
+        return sorted(e for e, types in self.extensions.items() if media in types)
+
+    def get_catalog_entry(self, key):
+        # Shared device catalog entries; each is parsed once and reused by
+        # every machine that references it.
+        if key not in self.catalog_cache:
+            self.catalog_cache[key] = self.load_plist(os.path.join('catalog', f'{key}.plist'))
+        return self.catalog_cache[key]
+
     def get_software_lists(self, machine_name):
         desc = self.get_machine_description(machine_name)
         if not desc or 'software' not in desc:
@@ -77,10 +146,27 @@ class DataManager:
                     })
         return results
 
+    def load_software_index(self, xml_file):
+        # Precompiled list (mksoftware.py): already parsed and sorted
+        path = os.path.join(self.resources_path, 'software', xml_file.replace(".xml", ".plist"))
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return plistlib.load(f)
+        except Exception as e:
+            print(f"Error loading software index {path}: {e}")
+            return None
+
     def load_software_xml(self, xml_file):
         if xml_file in self.software_cache:
             return self.software_cache[xml_file]['items']
         
+        index = self.load_software_index(xml_file)
+        if index is not None:
+            self.software_cache[xml_file] = index
+            return index['items']
+        
         if not self.hash_path:
             return []
             
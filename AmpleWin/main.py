@@ -15,7 +15,7 @@ from PySide6.QtGui import QFont, QIcon, QPalette, QColor, QCloseEvent, QPainter,
 import shutil
 from data_manager import DataManager
 from mame_launcher import MameLauncher
-from rom_manager import RomManager, DownloadWorker
+from rom_manager import RomManager, DownloadWorker, format_size
 from mame_downloader import MameDownloadWorker, VgmModDownloadWorker
 
 try:
@@ -53,7 +53,7 @@ class VgmPostProcessWorker(QThread):
         self.finished.emit()
 
 class RomItemWidget(QWidget):
-    def __init__(self, description, value, exists, parent=None):
+    def __init__(self, description, value, exists, size=0, parent=None):
         super().__init__(parent)
         self.exists = exists
         layout = QVBoxLayout(self)
@@ -61,7 +61,10 @@ class RomItemWidget(QWidget):
         layout.setSpacing(2)
         
         self.title_label = QLabel(description)
-        self.status_label = QLabel("ROM found" if exists else "ROM missing")
+        status = "ROM found" if exists else "ROM missing"
+        if size:
+            status += f" · {format_size(size)}"
+        self.status_label = QLabel(status)
         
         layout.addWidget(self.title_label)
         layout.addWidget(self.status_label)
@@ -80,12 +83,18 @@ class RomItemWidget(QWidget):
         self.status_label.setStyleSheet(f"font-size: 11px; color: #888888;")
 
 class RomManagerDialog(QDialog):
-    def __init__(self, rom_manager, parent=None):
+    def __init__(self, rom_manager, parent=None, machine=None, filter_mode="all"):
         super().__init__(parent)
         self.rom_manager = rom_manager
         self.setWindowTitle("ROMs")
         self.setMinimumSize(650, 550)
-        self.filter_mode = "all" # "all" or "missing"
+        # ROM sets the selected machine needs, if known
+        self.machine = machine
+        self.machine_roms = set(rom_manager.get_required_roms(machine) or []) if machine else set()
+        if filter_mode == "machine" and not self.machine_roms:
+            filter_mode = "all"
+        self.filter_mode = filter_mode # "all", "missing" or "machine"
+        self.max_downloads = 4 # concurrent transfers
         self.init_ui()
         self.apply_dialog_theme()
         self.refresh_list()
@@ -103,13 +112,19 @@ class RomManagerDialog(QDialog):
         
         self.seg_all = QPushButton("All")
         self.seg_all.setCheckable(True)
-        self.seg_all.setChecked(True)
+        self.seg_all.setChecked(self.filter_mode == "all")
         self.seg_missing = QPushButton("Missing")
         self.seg_missing.setCheckable(True)
+        self.seg_missing.setChecked(self.filter_mode == "missing")
+        self.seg_machine = QPushButton(self.machine or "")
+        self.seg_machine.setCheckable(True)
+        self.seg_machine.setChecked(self.filter_mode == "machine")
+        self.seg_machine.setVisible(bool(self.machine_roms))
         
         self.seg_group = QButtonGroup(self)
         self.seg_group.addButton(self.seg_all)
         self.seg_group.addButton(self.seg_missing)
+        self.seg_group.addButton(self.seg_machine)
         self.seg_group.buttonClicked.connect(self.on_filter_changed)
 
         self.rom_search = QLineEdit()
@@ -121,6 +136,7 @@ class RomManagerDialog(QDialog):
         header_layout.addSpacing(20)
         header_layout.addWidget(self.seg_all)
         header_layout.addWidget(self.seg_missing)
+        header_layout.addWidget(self.seg_machine)
         header_layout.addStretch()
         main_layout.addWidget(header)
 
@@ -188,7 +204,10 @@ class RomManagerDialog(QDialog):
         self.apply_dialog_theme()
 
     def on_filter_changed(self, btn):
-        self.filter_mode = "all" if btn == self.seg_all else "missing"
+        if btn == self.seg_machine:
+            self.filter_mode = "machine"
+        else:
+            self.filter_mode = "all" if btn == self.seg_all else "missing"
         self.refresh_list()
 
     def refresh_list(self):
@@ -199,12 +218,14 @@ class RomManagerDialog(QDialog):
         for s in statuses:
             if self.filter_mode == "missing" and s['exists']:
                 continue
+            if self.filter_mode == "machine" and s['value'] not in self.machine_roms:
+                continue
                 
             if query and query not in s['description'].lower() and query not in s['value'].lower():
                 continue
 
             item = QListWidgetItem(self.rom_list)
-            widget = RomItemWidget(s['description'], s['value'], s['exists'])
+            widget = RomItemWidget(s['description'], s['value'], s['exists'], s['size'])
             item.setSizeHint(widget.sizeHint())
             self.rom_list.addItem(item)
             self.rom_list.setItemWidget(item, widget)
@@ -219,52 +240,108 @@ class RomManagerDialog(QDialog):
             
         statuses = self.rom_manager.get_rom_status()
         self.to_download = [s for s in statuses if not s['exists']]
+        if self.filter_mode == "machine":
+            # Only what the selected machine needs
+            self.to_download = [s for s in self.to_download if s['value'] in self.machine_roms]
         if not self.to_download:
             QMessageBox.information(self, "Done", "All ROMs are already present!")
             return
         
+        # Schedule: sets the selected machine needs first (so it's usable as
+        # soon as possible), then smallest first
+        self.to_download.sort(key=lambda s: (s['value'] not in self.machine_roms, s['size']))
+        
         self.progress_area.setVisible(True)
         self.download_total = len(self.to_download)
         self.download_finished_count = 0
         self.download_failed_count = 0  # Reset failed count
-        self.progress_bar.setMaximum(self.download_total)
+        # Byte-level progress: expected (uncompressed) sizes from roms.plist,
+        # replaced by the real download size once a transfer reports it
+        self.download_expected = {s['value']: s['size'] for s in self.to_download}
+        self.download_sizes = {}
+        self.download_received = {}
+        self.download_start = time.monotonic()
+        self.progress_bar.setMaximum(1000)
         self.progress_bar.setValue(0)
         
-        # Ultra-fast Concurrent Execution using QThreadPool
+        # A few transfers at a time, in schedule order, rather than all at once:
+        # with limited bandwidth everything would otherwise finish at the end
         pool = QThreadPool.globalInstance()
-        # Set to 50 to allow explosive downloading of many small files
-        if pool.maxThreadCount() < 50:
-            pool.setMaxThreadCount(50)
-            
-        for current in self.to_download:
-            value = current['value']
-            ext = self.type_combo.currentText()
-            
-            # Prepare all possible URLs: Primary (UI) + others from the list
-            urls = []
-            primary_url = self.url_combo.currentText()
-            if not primary_url.endswith("/"): primary_url += "/"
-            urls.append(f"{primary_url}{value}.{ext}")
-            
-            for base in self.rom_manager.base_urls:
-                if base.strip("/") != primary_url.strip("/"):
-                    if not base.endswith("/"): base += "/"
-                    urls.append(f"{base}{value}.{ext}")
-            
-            dest = os.path.join(self.rom_manager.roms_dir, f"{value}.{ext}")
-            
-            worker = DownloadWorker(urls, dest, value)
-            # Signal handling for QRunnable via proxy object
-            worker.signals.finished.connect(lambda v, s, w=worker: self.on_concurrent_download_finished(w, v, s))
-            pool.start(worker)
+        if pool.maxThreadCount() < self.max_downloads:
+            pool.setMaxThreadCount(self.max_downloads)
+        self.download_queue = list(self.to_download)
+        for _ in range(self.max_downloads):
+            self.start_next_download()
+
+    def start_next_download(self):
+        if not self.download_queue:
+            return
+        current = self.download_queue.pop(0)
+        value = current['value']
+        ext = self.type_combo.currentText()
+        
+        # Prepare all possible URLs: Primary (UI) + others from the list
+        urls = []
+        primary_url = self.url_combo.currentText()
+        if not primary_url.endswith("/"): primary_url += "/"
+        urls.append(f"{primary_url}{value}.{ext}")
+        
+        for base in self.rom_manager.base_urls:
+            if base.strip("/") != primary_url.strip("/"):
+                if not base.endswith("/"): base += "/"
+                urls.append(f"{base}{value}.{ext}")
+        
+        dest = os.path.join(self.rom_manager.roms_dir, f"{value}.{ext}")
+        
+        worker = DownloadWorker(urls, dest, value)
+        # Signal handling for QRunnable via proxy object
+        worker.signals.progress.connect(self.on_download_progress)
+        worker.signals.finished.connect(lambda v, s, w=worker: self.on_concurrent_download_finished(w, v, s))
+        QThreadPool.globalInstance().start(worker)
+
+    def download_estimate(self):
+        # (received, estimated total) bytes. Sets that haven't reported a size
+        # yet are scaled by the compression seen so far, or (with an older
+        # roms.plist that has no sizes) count as an average set.
+        known = [v for v in self.download_sizes if self.download_expected.get(v)]
+        expected = sum(self.download_expected[v] for v in known)
+        ratio = sum(self.download_sizes[v] for v in known) / expected if expected else 1.0
+        sizes = self.download_sizes.values()
+        average = sum(sizes) / len(sizes) if sizes else 65536
+        total = sum(sizes)
+        for v, n in self.download_expected.items():
+            if v not in self.download_sizes:
+                total += n * ratio if n else average
+        return sum(self.download_received.values()), max(total, 1)
+
+    def update_download_status(self, value):
+        received, total = self.download_estimate()
+        self.progress_bar.setValue(min(1000, int(received * 1000 / total)))
+        elapsed = time.monotonic() - self.download_start
+        eta = ""
+        if received and elapsed > 1:
+            left = max(0, total - received) / (received / elapsed)
+            eta = f" · {int(left) // 60}:{int(left) % 60:02d} left"
+        self.status_label.setText(f"{self.download_finished_count}/{self.download_total} · "
+            f"{format_size(received)} of {format_size(int(total))}{eta} · {value}")
+
+    def on_download_progress(self, value, received, total):
+        if total:
+            self.download_sizes[value] = total
+        self.download_received[value] = received
+        self.update_download_status(value)
 
     def on_concurrent_download_finished(self, worker, value, success):
         self.download_finished_count += 1
         if not success:
             self.download_failed_count = getattr(self, "download_failed_count", 0) + 1
+            # Nothing more to come for this one
+            self.download_sizes[value] = self.download_received.get(value, 0)
+        else:
+            self.download_sizes.setdefault(value, self.download_received.get(value, 0))
             
-        self.progress_bar.setValue(self.download_finished_count)
-        self.status_label.setText(f"Finished {self.download_finished_count}/{self.download_total}: {value}")
+        self.update_download_status(value)
+        self.start_next_download()
         
         if self.download_finished_count == self.download_total:
             self.progress_area.setVisible(False)
@@ -480,8 +557,9 @@ class SubSlotPopup(QDialog):
 
     def on_changed(self):
         combo = self.sender()
+        old_val = self.current_slots.get(combo.objectName())
         self.current_slots[combo.objectName()] = combo.currentData()
-        self.on_change_callback()
+        self.on_change_callback(combo.objectName(), old_val)
 
 # --- Software List Popup (Overlay) ---
 class SoftwarePopup(QDialog):
@@ -676,6 +754,8 @@ class AmpleMainWindow(QMainWindow):
         
         self.selected_machine = None
         self.current_slots = {}
+        self.media_totals = None # Precomputed media counts for current_slots (None: walk the slot graph)
+        self.slots_resolved = False # current_slots already holds every default
         self.current_media = {}
         self.launcher.working_dir = mame_bin_dir
         
@@ -1101,7 +1181,10 @@ class AmpleMainWindow(QMainWindow):
         machine_name = item.data(0, Qt.UserRole)
         if not machine_name: return
         self.selected_machine = machine_name
-        self.current_slots = {} # Reset slots for the new machine
+        # Reset slots (and the media cached for them) for the new machine
+        self.current_slots = {}
+        self.media_totals = None
+        self.slots_resolved = False
         self.machine_title_bar = item.text(0)
         self.setWindowTitle(f"Ample - {self.machine_title_bar}")
         
@@ -1116,7 +1199,13 @@ class AmpleMainWindow(QMainWindow):
         data = self.data_manager.get_machine_description(machine_name)
         if data:
             self.current_machine_data = data
-            self.initialize_default_slots(data)
+            if 'defaults' in data and 'default_media' in data:
+                # Precomputed by mkmachines.py: no graph walk needed
+                self.current_slots = dict(data['defaults'])
+                self.media_totals = dict(data['default_media'])
+                self.slots_resolved = True
+            else:
+                self.initialize_default_slots(data)
             self.refresh_ui()
             # 不再於切換時立即填充軟體清單 (延遲加載以優化效能)
             if hasattr(self, 'sw_list'): self.sw_list.clear()
@@ -1179,9 +1268,42 @@ class AmpleMainWindow(QMainWindow):
         self.current_machine_data = data
         self.refresh_ui()
 
+    def apply_slot_change(self, slot_name, old_val, new_val):
+        # Precomputed per-option deltas: swap the old option's media and
+        # sub-slot defaults for the new one's. Only valid while the old
+        # option's subtree is still at its defaults and none of the slots
+        # involved can appear twice; otherwise fall back to walking the
+        # slot graph. (An empty value is re-defaulted by that walk, so it
+        # always takes the slow path.)
+        data = self.current_machine_data or {}
+        if self.media_totals is None or 'option_deltas' not in data:
+            self.media_totals = None
+            self.slots_resolved = False
+            return
+        deltas = data['option_deltas'].get(slot_name, {})
+        old_d = deltas.get(str(old_val), {})
+        new_d = deltas.get(str(new_val), {})
+        shared = set(data.get('shared_slots', []))
+        if (not new_val or slot_name in shared
+                or any(k in shared for k in old_d.get('defaults', {}))
+                or any(k in shared for k in new_d.get('defaults', {}))
+                or any(self.current_slots.get(k) != v for k, v in old_d.get('defaults', {}).items())):
+            self.media_totals = None
+            self.slots_resolved = False
+            return
+        for k, v in old_d.get('media', {}).items():
+            self.media_totals[k] = self.media_totals.get(k, 0) - v
+        for k, v in new_d.get('media', {}).items():
+            self.media_totals[k] = self.media_totals.get(k, 0) + v
+        self.current_slots.update(new_d.get('defaults', {}))
+
+    def on_sub_slot_changed(self, slot_name, old_val):
+        self.apply_slot_change(slot_name, old_val, self.current_slots.get(slot_name))
+        self.refresh_ui()
+
     def refresh_ui(self):
         # 0. Re-initialize defaults for any newly appeared slots/devices
-        if self.current_machine_data:
+        if self.current_machine_data and not self.slots_resolved:
             self.initialize_default_slots(self.current_machine_data)
 
         # 1. Clean the fixed layouts without destroying the frames themselves
@@ -1423,7 +1545,7 @@ class AmpleMainWindow(QMainWindow):
             # Note: closeEvent will set self.active_popup = None
             
         # Create and show the popup relative to the button
-        popup = SubSlotPopup(self, data, self.current_slots, self.refresh_ui)
+        popup = SubSlotPopup(self, data, self.current_slots, self.on_sub_slot_changed)
         self.active_popup = popup
         
         pos = button.mapToGlobal(QPoint(button.width(), 0))
@@ -1432,6 +1554,13 @@ class AmpleMainWindow(QMainWindow):
         popup.show()
 
     def get_total_media(self):
+        if self.media_totals is not None:
+            total_media = {}
+            for k, v in self.media_totals.items():
+                key = 'cassette' if k == 'cass' else k
+                total_media[key] = total_media.get(key, 0) + v
+            return {k: v for k, v in total_media.items() if v > 0}
+
         total_media = {}
         
         def find_global_def(name):
@@ -1481,6 +1610,12 @@ class AmpleMainWindow(QMainWindow):
         return total_media
 
     def get_filtered_media(self):
+        media_types = self.get_media_types()
+        return {k: v for k, v in self.current_media.items() if k in media_types}
+
+    def get_media_types(self):
+        # MAME media option (flop1, hard1, cass, ...) -> media type, for the
+        # drives the current machine/slots have.
         total_media = self.get_total_media()
         PREFIX_MAP = {
             'floppy_5_25': 'flop',
@@ -1491,7 +1626,7 @@ class AmpleMainWindow(QMainWindow):
             'cass': 'cass'
         }
         counters = {"flop": 0, "hard": 0, "cdrom": 0, "cass": 0}
-        active_keys = set()
+        media_types = {}
         
         # We must iterate in a consistent order if we want flop1, flop2 etc to be stable
         # Using the same order as in add_media_group calls
@@ -1506,9 +1641,26 @@ class AmpleMainWindow(QMainWindow):
                     key = f"{m_prefix}{idx}"
                     if m_prefix == "cass" and idx == 1 and count == 1:
                         key = "cass"
-                    active_keys.add(key)
-        
-        return {k: v for k, v in self.current_media.items() if k in active_keys}
+                    media_types[key] = m_type_key
+        
+        return media_types
+
+    def get_media_extensions(self, m_type):
+        if not self.selected_machine: return []
+        media = 'cass' if m_type == 'cassette' else m_type
+        return self.data_manager.get_media_extensions(self.selected_machine, media)
+
+    def get_unsupported_media(self):
+        # Mounted files whose extension the drive doesn't accept. Drives
+        # with no known extensions accept anything.
+        media_types = self.get_media_types()
+        bad = []
+        for key, path in self.get_filtered_media().items():
+            exts = self.get_media_extensions(media_types[key])
+            ext = os.path.splitext(path)[1][1:].lower()
+            if exts and ext not in exts:
+                bad.append(f"-{key} {os.path.basename(path)}")
+        return bad
 
     def render_media_ui(self):
         # 1. Clear media layout EXCEPT for Software List at the top (if we want to keep it)
@@ -1631,7 +1783,7 @@ class AmpleMainWindow(QMainWindow):
                         }
                         QPushButton:hover { background-color: #4a8df0; }
                     """)
-                    btn_sel.clicked.connect(lambda _, k=key, e=edit: self.browse_media(k, e))
+                    btn_sel.clicked.connect(lambda _, k=key, e=edit, t=m_type_key: self.browse_media(k, e, t))
                     
                     # Eject Button
                     btn_eject = QPushButton("⏏")
@@ -1739,7 +1891,9 @@ class AmpleMainWindow(QMainWindow):
 
     def on_slot_changed(self):
         combo = self.sender()
+        old_val = self.current_slots.get(combo.objectName())
         self.current_slots[combo.objectName()] = combo.currentData()
+        self.apply_slot_change(combo.objectName(), old_val, combo.currentData())
         # Full refresh because changing a slot might add more slots OR change media
         self.refresh_ui()
 
@@ -1749,8 +1903,15 @@ class AmpleMainWindow(QMainWindow):
             edit.clear()
             self.update_command_line()
 
-    def browse_media(self, key, edit):
-        path, _ = QFileDialog.getOpenFileName(self, f"Select file for {key}")
+    def browse_media(self, key, edit, m_type=None):
+        # Offer only the image types this drive accepts (from the
+        # generated extension index), keeping an escape hatch.
+        filters = "All Files (*)"
+        exts = self.get_media_extensions(m_type) if m_type else []
+        if exts:
+            patterns = " ".join(f"*.{e}" for e in exts)
+            filters = f"Supported Images ({patterns});;{filters}"
+        path, _ = QFileDialog.getOpenFileName(self, f"Select file for {key}", "", filters)
         if path:
             edit.setText(path)
             self.current_media[key] = path
@@ -1904,8 +2065,8 @@ class AmpleMainWindow(QMainWindow):
             # Layout items that are not widgets or layouts are rare but handled by takeAt
 
     @Slot()
-    def show_rom_manager(self):
-        self.rom_manager_dialog = RomManagerDialog(self.rom_manager, self)
+    def show_rom_manager(self, filter_mode="all"):
+        self.rom_manager_dialog = RomManagerDialog(self.rom_manager, self, self.selected_machine, filter_mode or "all")
         # apply_dialog_theme is already called in RomManagerDialog.__init__
         self.rom_manager_dialog.exec()
 
@@ -2050,6 +2211,33 @@ class AmpleMainWindow(QMainWindow):
             
         if not args: return
 
+        # Check the machine's ROM sets up front rather than letting MAME fail on startup
+        if self.selected_machine:
+            missing = self.rom_manager.get_missing_roms(self.selected_machine)
+            if missing:
+                res = QMessageBox.question(self, "Missing ROMs",
+                    f"{self.selected_machine} needs ROMs that are not in your ROMs folder:\n\n"
+                    f"{', '.join(missing)}\n\n"
+                    "Open the ROM manager to download them?",
+                    QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
+                if res == QMessageBox.Yes:
+                    self.show_rom_manager("machine")
+                    return
+                if res == QMessageBox.Cancel:
+                    return
+
+            # Catch images the drives can't take before MAME spends time starting up
+            bad = self.get_unsupported_media()
+            if bad:
+                files = "\n".join(bad)
+                res = QMessageBox.question(self, "Unsupported Media",
+                    f"{self.selected_machine} does not accept these files:\n\n"
+                    f"{files}\n\n"
+                    "Launch anyway?",
+                    QMessageBox.Yes | QMessageBox.No)
+                if res != QMessageBox.Yes:
+                    return
+
         try:
             # Resolve executable path from bare filename to absolute path
             # This fixes [WinError 2] where Popen(cwd=...) fails to find bare 'mame'
@@ -3,8 +3,14 @@ import requests
 import plistlib
 from PySide6.QtCore import QObject, Signal, QRunnable, QThreadPool
 
+def format_size(n):
+    for unit in ['bytes', 'KB', 'MB']:
+        if n < 1024 or unit == 'MB':
+            return f"{n} {unit}" if unit == 'bytes' else f"{n:.1f} {unit}"
+        n /= 1024
+
 class DownloadSignals(QObject):
-    progress = Signal(int, int) # current, total
+    progress = Signal(str, int, int) # value, received, total (0 if unknown)
     finished = Signal(str, bool) # value, success
     status = Signal(str)
 
@@ -29,16 +35,25 @@ class DownloadWorker(QRunnable):
             try:
                 if self._is_cancelled: return
                 
-                # For small files (ROMs), direct download is much faster than streaming
-                response = requests.get(url, headers=self.headers, timeout=20)
+                # Streamed in chunks so the dialog can show byte-level progress
+                self.signals.progress.emit(self.value, 0, 0)
+                response = requests.get(url, headers=self.headers, timeout=20, stream=True)
                 response.raise_for_status()
+                total = int(response.headers.get('content-length', 0))
                 
                 os.makedirs(os.path.dirname(self.dest_path), exist_ok=True)
                 
-                if self._is_cancelled: return
-                
+                received = 0
                 with open(self.dest_path, 'wb') as f:
-                    f.write(response.content)
+                    for chunk in response.iter_content(chunk_size=65536):
+                        if self._is_cancelled: break
+                        f.write(chunk)
+                        received += len(chunk)
+                        self.signals.progress.emit(self.value, received, total)
+                
+                if self._is_cancelled:
+                    os.remove(self.dest_path)
+                    return
                 
                 self.signals.finished.emit(self.value, True)
                 return # Success!
@@ -63,6 +78,8 @@ class RomManager(QObject):
             "https://mdk.cab/download/split/"
         ]
         self.rom_list = self.load_rom_list()
+        # machine -> [rom set, ...] it needs (romdeps.plist, from mkroms.py --closure)
+        self.rom_deps = self.load_rom_deps()
 
     def load_rom_list(self):
         path = os.path.join(self.resources_path, "roms.plist")
@@ -71,30 +88,41 @@ class RomManager(QObject):
         with open(path, 'rb') as f:
             return plistlib.load(f)
 
+    def load_rom_deps(self):
+        path = os.path.join(self.resources_path, "romdeps.plist")
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'rb') as f:
+            return plistlib.load(f)
+
+    def rom_exists(self, value):
+        # Check for zip, 7z or folder
+        for ext in ['zip', '7z']:
+            path = os.path.join(self.roms_dir, f"{value}.{ext}")
+            if os.path.exists(path):
+                return True
+        # Check for unzipped folder
+        return os.path.isdir(os.path.join(self.roms_dir, value))
+
     def get_rom_status(self):
         status_list = []
         for rom in self.rom_list:
             value = rom['value']
-            # Check for zip, 7z or folder
-            found = False
-            for ext in ['zip', '7z']:
-                path = os.path.join(self.roms_dir, f"{value}.{ext}")
-                if os.path.exists(path):
-                    found = True
-                    break
-            
-            if not found:
-                # Check for unzipped folder
-                path = os.path.join(self.roms_dir, value)
-                if os.path.isdir(path):
-                    found = True
-            
             status_list.append({
                 'value': value,
                 'description': rom['description'],
-                'exists': found
+                'exists': self.rom_exists(value),
+                'size': rom.get('size', 0), # uncompressed bytes (0 if unknown)
+                'files': rom.get('files', 0)
             })
         return status_list
 
+    def get_required_roms(self, machine):
+        # None if there's no dependency data for this machine
+        return self.rom_deps.get(machine)
+
+    def get_missing_roms(self, machine):
+        return [v for v in self.get_required_roms(machine) or [] if not self.rom_exists(v)]
+
     def get_download_url(self, value, ext='zip'):
         return f"{self.base_url}{value}.{ext}"
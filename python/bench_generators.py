@@ -0,0 +1,113 @@
+
+#
+# scaling benchmark for the generators, run against fakemame.py.
+#
+# python3 bench_generators.py [--scales 10,100,1000] [-j N] [--json out.json]
+#
+# for each scale, a scratch tree gets a synthetic mame with scale x the
+# number of machines in machines.py; the -listxml is ingested into a mamedb,
+# then mkmachines, mkroms and mkmodels are run over every synthetic machine.
+# reports wall time and peak rss for each step.  The other FAKEMAME_*
+# settings (devices, slots, fan-out, depth) are passed through from the
+# environment.
+#
+# mkmodels builds the fixed models tree, so it doesn't grow with scale.
+#
+
+import argparse
+import glob
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from machines import MACHINES
+import fakemame
+
+
+def make_tree(root):
+	# <root>/python has links to the scripts, so outputs, mame.db, caches
+	# and manifests all land in the scratch tree.
+	here = os.path.dirname(os.path.abspath(__file__))
+	os.makedirs(os.path.join(root, "python"))
+	os.makedirs(os.path.join(root, "Ample", "Resources"))
+	for x in glob.glob(os.path.join(here, "*.py")):
+		os.symlink(x, os.path.join(root, "python", os.path.basename(x)))
+	return os.path.join(root, "python")
+
+
+def make_mame(cwd, env):
+	# mame.py runs mame with its own (minimal) environment, so the
+	# FAKEMAME_* settings are baked into a wrapper script.
+	path = os.path.join(cwd, "mame")
+	with open(path, "w") as f:
+		f.write("#!/bin/sh\n")
+		for k, v in sorted(env.items()):
+			if k.startswith("FAKEMAME_"): f.write("{}={}; export {}\n".format(k, shlex.quote(v), k))
+		f.write("exec {} {} \"$@\"\n".format(shlex.quote(sys.executable), shlex.quote(os.path.join(cwd, "fakemame.py"))))
+	os.chmod(path, 0o755)
+	return path
+
+
+def run_timed(argv, cwd, env):
+	# (seconds, peak rss in bytes) of one generator run.
+	t = time.perf_counter()
+	proc = subprocess.Popen([sys.executable, *argv], cwd=cwd, env=env, stdout=subprocess.DEVNULL)
+	_, st, ru = os.wait4(proc.pid, 0)
+	t = time.perf_counter() - t
+	proc.returncode = os.waitstatus_to_exitcode(st)
+	if proc.returncode != 0:
+		raise subprocess.CalledProcessError(proc.returncode, argv)
+	rss = ru.ru_maxrss
+	if sys.platform != 'darwin': rss *= 1024 # linux reports kilobytes
+	return t, rss
+
+
+def bench(scale, args):
+
+	n = scale * len(MACHINES)
+	root = tempfile.mkdtemp(prefix="ample-bench-")
+	try:
+		cwd = make_tree(root)
+		env = dict(os.environ)
+		env['FAKEMAME_MACHINES'] = str(n)
+		env['AMPLE_MAME'] = make_mame(cwd, env)
+
+		with open(os.path.join(cwd, "machines.txt"), "w") as f:
+			for i in range(n): f.write(fakemame.machine_name(i) + "\n")
+
+		steps = [
+			("ingest", ["mamedb.py", "--db", "bench.db"]),
+			("mkmachines", ["mkmachines.py", "--db", "bench.db", "-j", str(args.jobs), "@machines.txt"]),
+			("mkroms", ["mkroms.py", "--db", "bench.db", "@machines.txt"]),
+			("mkmodels", ["mkmodels.py", "--db", "bench.db"]),
+		]
+		rv = {}
+		for name, argv in steps:
+			t, rss = run_timed(argv, cwd, env)
+			rv[name] = { 'seconds': t, 'peak_rss': rss }
+			print("{:>6}x {:>8} machines  {:<12} {:9.2f}s {:8.1f} MB {:8.2f} ms/machine".format(
+				scale, n, name, t, rss / (1024 * 1024), t * 1000 / n), flush=True)
+		return { 'scale': scale, 'machines': n, 'steps': rv }
+	finally:
+		if args.keep: print("kept", root)
+		else: shutil.rmtree(root)
+
+
+p = argparse.ArgumentParser()
+p.add_argument('--scales', default="10,100,1000", help='multiples of the current machine count (default 10,100,1000)')
+p.add_argument('-j', '--jobs', type=int, default=1, help='mkmachines worker processes (default 1)')
+p.add_argument('--json', help='also write the results here')
+p.add_argument('--keep', action='store_true', help='keep the scratch trees')
+args = p.parse_args()
+
+results = [bench(int(x), args) for x in args.scales.split(",")]
+
+if args.json:
+	with open(args.json, "w") as f:
+		json.dump(results, f, indent="\t")
+		f.write("\n")
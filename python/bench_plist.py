@@ -0,0 +1,139 @@
+
+#
+# micro-benchmark for plist.py against plistlib, using the real
+# Ample/Resources data.
+#
+# python3 bench_plist.py [-n 5] [glob ...]
+#
+# default globs are everything and the bbcb* family (the biggest plists).
+# reports best-of-n wall time and peak python allocations (tracemalloc)
+# for each encoder.  "reference" is a copy of the original to_plist, kept
+# here to measure against.
+#
+
+import argparse
+import glob
+import os
+import plistlib
+import time
+import tracemalloc
+
+from xml.sax.saxutils import escape
+
+import plist
+from plist import to_plist, dump_plist
+
+
+#
+# the original (pre-streaming) encoder: one formatted fragment per value,
+# dispatched through a type table, joined at the end.
+#
+def _ref_array(x, akku, indent=""):
+	indent2 = indent + plist.INDENT
+	akku.append(indent + "<array>\n")
+	for v in x:
+		_ref_encoder.get(type(v), plist._bad)(v, akku, indent2)
+	akku.append(indent + "</array>\n")
+
+def _ref_dict(x, akku, indent=""):
+	indent2 = indent + plist.INDENT
+	akku.append(indent + "<dict>\n")
+	for k,v in x.items():
+		if type(k) != str:
+			raise ValueError("plist: dictionary key must be string: {}: {}".format(type(k), k))
+		akku.append("{}<key>{}</key>\n".format(indent2, escape(k)))
+		_ref_encoder.get(type(v), plist._bad)(v, akku, indent2)
+	akku.append(indent + "</dict>\n")
+
+def _ref_bool(x, akku, indent=""):
+	if x: akku.append(indent + "<true/>\n")
+	else: akku.append(indent + "<false/>\n")
+
+def _ref_integer(x, akku, indent=""):
+	akku.append("{}<integer>{}</integer>\n".format(indent, x))
+
+def _ref_string(x, akku, indent=""):
+	akku.append("{}<string>{}</string>\n".format(indent, escape(x)))
+
+_ref_encoder = {
+	**plist._encoder,
+	str: _ref_string,
+	int: _ref_integer,
+	bool: _ref_bool,
+	tuple: _ref_array,
+	list: _ref_array,
+	dict: _ref_dict,
+}
+
+def ref_to_plist(x):
+	akku = [plist._header]
+	_ref_encoder.get(type(x), plist._bad)(x, akku, plist.INDENT)
+	akku.append(plist._trailer)
+	return ''.join(akku)
+
+
+def load(pattern):
+	rv = []
+	for path in sorted(glob.glob(os.path.join("../Ample/Resources", pattern))):
+		with open(path, 'rb') as f:
+			rv.append(plistlib.load(f))
+	return rv
+
+
+def enc_to_plist(data):
+	with open(os.devnull, "w") as f:
+		for x in data: f.write(to_plist(x))
+
+def enc_reference(data):
+	with open(os.devnull, "w") as f:
+		for x in data: f.write(ref_to_plist(x))
+
+def enc_dump_plist(data):
+	with open(os.devnull, "w") as f:
+		for x in data: dump_plist(x, f)
+
+def enc_plistlib(data):
+	with open(os.devnull, "wb") as f:
+		for x in data: f.write(plistlib.dumps(x, fmt=plistlib.FMT_XML))
+
+
+ENCODERS = (
+	("plist.dump_plist", enc_dump_plist),
+	("plist.to_plist", enc_to_plist),
+	("reference", enc_reference),
+	("plistlib.dumps", enc_plistlib),
+)
+
+
+def best_time(fn, data, n):
+	best = None
+	for i in range(n):
+		t = time.perf_counter()
+		fn(data)
+		t = time.perf_counter() - t
+		if best is None or t < best: best = t
+	return best
+
+def peak_memory(fn, data):
+	tracemalloc.start()
+	fn(data)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return peak
+
+
+p = argparse.ArgumentParser()
+p.add_argument('-n', type=int, default=5, help='iterations (default 5)')
+p.add_argument('pattern', nargs="*", default=["*.plist", "bbcb*.plist"])
+args = p.parse_args()
+
+for pattern in args.pattern:
+	data = load(pattern)
+	print("{} ({} files)".format(pattern, len(data)))
+	base = None
+	for name, fn in ENCODERS:
+		t = best_time(fn, data, args.n)
+		m = peak_memory(fn, data)
+		if base is None: base = t
+		print("  {:<18} {:8.1f} ms  {:5.2f}x  peak {:8.1f} KB".format(name, t * 1000, t / base, m / 1024))
+	print()
@@ -0,0 +1,356 @@
+
+#
+# one-shot build of everything in Ample/Resources:
+#
+# python3 build_resources.py [-j N] [--format binary] [--catalog] [--watch]
+#
+# mame -listxml is ingested into a mamedb once; every generator then reads
+# the database instead of running mame.  Stages run as a dependency graph
+# (independent ones concurrently), for both the normal and --extra variants.
+#
+# --watch: after the build, poll the generator sources and the mame binary.
+# An edited source reruns the stages whose scripts import it (directly or
+# not), except those that only take data from it (eg, SLOTS out of
+# machines.py) that didn't change; stages downstream of a rerun one rerun
+# too, and a changed hash/*.xml reruns mksoftware.  mkmachines runs in this
+# process (its caches are loaded before the first wait), so its machine
+# cache stays loaded between runs and only machines whose fingerprint
+# changed are rebuilt.  A new mame binary rebuilds everything.
+#
+
+import argparse
+import ast
+import contextlib
+import glob
+import importlib.util
+import io
+import os
+import subprocess
+import sys
+import time
+import traceback
+import types
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import mame
+import mamedb
+from plist import FORMATS
+
+
+class Stage(object):
+	__slots__ = ('name', 'argv', 'deps', 'module', 'sources', 'imports', 'time', 'output')
+
+	def __init__(self, name, argv, deps=(), module=None):
+		self.name = name
+		self.argv = argv
+		self.deps = deps
+		self.module = module # runs in-process under --watch
+		self.sources = script_sources(argv[0])
+		self.imports = imported_names(self.sources)
+		self.time = None
+		self.output = None
+
+
+def script_sources(path, rv=None, seen=None):
+	# the script and every local module it imports, dependencies first.
+	if rv is None: rv, seen = [], set()
+	seen.add(path)
+	with open(path) as f:
+		tree = ast.parse(f.read(), path)
+	for x in ast.walk(tree):
+		if isinstance(x, ast.Import): names = [y.name for y in x.names]
+		elif isinstance(x, ast.ImportFrom) and x.module and not x.level: names = [x.module]
+		else: continue
+		for name in names:
+			name += ".py"
+			if name not in seen and os.path.exists(name): script_sources(name, rv, seen)
+	rv.append(path)
+	return rv
+
+
+def imported_names(sources):
+	# local module -> the names taken from it with "from x import ...", or
+	# None if any of the sources imports the module itself.
+	rv = {}
+	for path in sources:
+		with open(path) as f:
+			tree = ast.parse(f.read(), path)
+		for x in ast.walk(tree):
+			if isinstance(x, ast.Import):
+				for y in x.names: rv[y.name + ".py"] = None
+			elif isinstance(x, ast.ImportFrom) and x.module and not x.level:
+				name = x.module + ".py"
+				if name in rv and rv[name] is None: continue
+				rv.setdefault(name, set()).update(y.name for y in x.names)
+	return rv
+
+
+def make_stages(args):
+
+	db = ['--db', args.db]
+	if args.mame: db += ['--mame', args.mame]
+	fmt = ['--format', args.format]
+	roms = [*db, *fmt]
+	if args.rom_hashes: roms.append('--hashes')
+	if args.rom_closure: roms.append('--closure')
+	machines = [*db, *fmt, '--jobs', str(args.jobs)]
+	if args.catalog: machines.append('--catalog')
+	if args.force: machines.append('--force')
+
+	ingest = ['mamedb.py', *db]
+	if args.force: ingest.append('--force')
+
+	return [
+		Stage('ingest', ingest),
+		Stage('models', ['mkmodels.py', *db, *fmt], ('ingest',)),
+		Stage('models~extra', ['mkmodels.py', '--extra', *db, *fmt], ('ingest',)),
+		Stage('roms', ['mkroms.py', *roms], ('ingest',)),
+		Stage('roms~extra', ['mkroms.py', '--extra', *roms], ('ingest',)),
+		Stage('devices', ['mkdevices.py', *db, *fmt], ('ingest',)),
+		# both variants share the build manifest (and overlapping plists), so
+		# they run one after the other.
+		Stage('machines~extra', ['mkmachines.py', '--extra', *machines], ('ingest',), 'mkmachines'),
+		Stage('machines', ['mkmachines.py', *machines], ('machines~extra',), 'mkmachines'),
+		# reads the software lists out of the machine plists.
+		Stage('software', ['mksoftware.py', *fmt, *(['--mame', args.mame] if args.mame else [])], ('machines',)),
+	]
+
+
+def run_stage(stage, in_process=False):
+	t = time.perf_counter()
+	if in_process and stage.module:
+		rv = run_in_process(stage)
+	else:
+		st = subprocess.run([sys.executable, *stage.argv], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+		stage.output = st.stdout
+		rv = st.returncode
+	stage.time = time.perf_counter() - t
+	return rv
+
+
+def run_in_process(stage):
+	# single process, so the module's caches are this process's.
+	out = io.StringIO()
+	rv = 0
+	try:
+		with contextlib.redirect_stdout(out):
+			importlib.import_module(stage.module).main([*stage.argv[1:], '--jobs', '1'])
+	except SystemExit as e:
+		rv = e.code or 0
+	except Exception:
+		out.write(traceback.format_exc())
+		rv = 1
+	stage.output = out.getvalue()
+	return rv
+
+
+def run(stages, parallel, in_process=False):
+	# returns the failed stage, if any.  Dependencies on stages that aren't
+	# being run are taken as met.
+
+	names = set(x.name for x in stages)
+	done = set()
+	pending = list(stages)
+	running = {}
+	with ThreadPoolExecutor(parallel) as ex:
+		while pending or running:
+			for s in [x for x in pending if all(d in done or d not in names for d in x.deps)]:
+				pending.remove(s)
+				running[ex.submit(run_stage, s, in_process)] = s
+
+			finished, _ = wait(running, return_when=FIRST_COMPLETED)
+			for f in finished:
+				s = running.pop(f)
+				if f.result() != 0:
+					for x in running: x.cancel()
+					return s
+				print("{}: done ({:.1f}s)".format(s.name, s.time))
+				done.add(s.name)
+	return None
+
+
+#
+# --watch
+#
+# mkmachines state that only depends on the mame data (parsed -listxml and
+# its digests); kept when the generator code is reloaded, unless the code
+# that produces it changed.
+WARM = ('machine_cache', '_xml_digest')
+WARM_SOURCES = set(['model.py', 'mame.py', 'mamedb.py'])
+
+def reload_modules(stages, changed, cold=False):
+	# reload the in-process modules (dependencies first) if any of their
+	# sources changed.  cold drops the warm caches too.
+	done = set()
+	for s in stages:
+		mod = sys.modules.get(s.module)
+		if mod is None or mod in done or not (cold or changed & set(s.sources)): continue
+		done.add(mod)
+		keep = {} if cold or changed & WARM_SOURCES else { k: getattr(mod, k) for k in WARM }
+		try:
+			for path in s.sources:
+				x = sys.modules.get(path[:-3])
+				if x: importlib.reload(x)
+		finally:
+			for k, v in keep.items(): setattr(mod, k, v)
+
+
+def module_values(path):
+	# top-level values of a local module, loaded on the side (not in
+	# sys.modules); None if it doesn't load.
+	spec = importlib.util.spec_from_file_location("_watch_" + path[:-3], path)
+	x = importlib.util.module_from_spec(spec)
+	try:
+		spec.loader.exec_module(x)
+	except Exception:
+		return None
+	return vars(x)
+
+CODE = (types.FunctionType, types.ModuleType, type)
+
+def affected(stage, changed, before, after):
+	# a stage that only takes data (eg, SLOTS from machines.py) out of a
+	# changed module is affected only if that data changed.
+	for path in changed & set(stage.sources):
+		names = stage.imports.get(path)
+		if names is None: return True
+		old, new = before.get(path), after.get(path)
+		if old is None or new is None: return True
+		for k in names:
+			a, b = old.get(k, CODE), new.get(k, CODE)
+			if isinstance(a, CODE) or isinstance(b, CODE) or a != b: return True
+	return False
+
+
+def downstream(stages, todo):
+	# stages are in dependency order; one that depends on a rerun stage
+	# (eg, mksoftware reading the machine plists) reruns with it.
+	names = set(x.name for x in todo)
+	for s in stages:
+		if any(d in names for d in s.deps): names.add(s.name)
+	return [s for s in stages if s.name in names]
+
+
+def snapshot(paths):
+	rv = {}
+	for x in paths:
+		try:
+			st = os.stat(x)
+			rv[x] = (st.st_mtime_ns, st.st_size)
+		except FileNotFoundError:
+			rv[x] = None
+	return rv
+
+
+def report(stages, failed):
+	if failed:
+		print("{}: failed ({})".format(failed.name, " ".join(failed.argv)))
+		print(failed.output, end="")
+		return
+	for s in stages:
+		if s.time is None: continue
+		for x in s.output.splitlines():
+			if x.endswith((": new", ": updated")): print("    " + x)
+
+
+def watch(args, stages):
+	binary = os.path.abspath(mame.path)
+	sources = sorted(set(x for s in stages for x in s.sources) | { binary })
+	# mksoftware's input (lists can be added, so it's globbed every poll.)
+	hashes = os.path.join(os.path.dirname(binary), "hash", "*.xml")
+	def files(): return sources + glob.glob(hashes)
+	state = snapshot(files())
+	values = { k: module_values(k) for s in stages for k, v in s.imports.items() if v is not None }
+
+	# the build ran in subprocesses; load the in-process stages' caches now
+	# (nothing is rewritten) so the first change isn't a cold run.
+	warm = [s for s in make_stages(args) if s.module]
+	print()
+	print("loading caches")
+	failed = run(warm, 1, True)
+	if failed: report(warm, failed)
+	print("watching {} files".format(len(state)))
+
+	while True:
+		time.sleep(args.interval)
+		now = snapshot(files())
+		if now == state: continue
+		# let the editor (or the mame build) finish writing.
+		while True:
+			time.sleep(0.2)
+			x = snapshot(files())
+			if x == now: break
+			now = x
+
+		changed = set(x for x in now.keys() | state.keys() if now.get(x) != state.get(x))
+		state = now
+		print()
+		print("changed: {}".format(", ".join(sorted(os.path.basename(x) for x in changed))))
+
+		t = time.perf_counter()
+		before = values.copy()
+		values.update((k, module_values(k)) for k in changed & values.keys())
+		try:
+			# (a source that doesn't parse fails here, until it's fixed.)
+			if binary in changed:
+				todo = make_stages(args)
+				reload_modules(todo, changed, True)
+				failed = run(todo, args.parallel)
+			else:
+				every = make_stages(args)
+				todo = [s for s in every if affected(s, changed, before, values)]
+				if any(x.endswith(".xml") for x in changed):
+					todo += [s for s in every if s.name == 'software' and s not in todo]
+				todo = downstream(every, todo)
+				if not todo:
+					print("nothing to rebuild")
+					continue
+				reload_modules(todo, changed)
+				failed = run(todo, 1, True)
+		except Exception:
+			traceback.print_exc()
+			continue
+		report(todo, failed)
+		print("{}: {:.1f}s".format(", ".join(s.name for s in todo), time.perf_counter() - t))
+
+
+p = argparse.ArgumentParser()
+p.add_argument('--db', default=mamedb.DEFAULT_PATH, help='mamedb path (default: {})'.format(mamedb.DEFAULT_PATH))
+p.add_argument('--mame', help='mame binary, for every stage (default: $AMPLE_MAME or {})'.format(mame.path))
+p.add_argument('-j', '--jobs', type=int, default=0, help='mkmachines worker processes (default: one per cpu)')
+p.add_argument('-p', '--parallel', type=int, default=4, help='stages run at once (default 4)')
+p.add_argument('--format', choices=FORMATS, default='xml', help='plist format (default xml)')
+p.add_argument('--catalog', action='store_true', help='store device slot trees in the shared device catalog')
+p.add_argument('--rom-hashes', action='store_true', help='also write the rom hash manifests')
+p.add_argument('--rom-closure', action='store_true', help='also write the per-machine rom set lists')
+p.add_argument('--force', action='store_true', help='re-ingest and rebuild everything')
+p.add_argument('--watch', action='store_true', help='keep running; rebuild what a source or mame change affects')
+p.add_argument('--interval', type=float, default=1.0, help='--watch poll interval in seconds (default 1)')
+args = p.parse_args()
+if args.mame: mame.path = args.mame = os.path.abspath(args.mame)
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+stages = make_stages(args)
+t = time.perf_counter()
+failed = run(stages, args.parallel)
+t = time.perf_counter() - t
+
+if failed:
+	print("{}: failed ({})".format(failed.name, " ".join(failed.argv)))
+	print(failed.output, end="")
+	if not args.watch: exit(1)
+else:
+	print()
+	for s in stages:
+		print("{:<16} {:8.1f}s".format(s.name, s.time))
+	print("{:<16} {:8.1f}s".format("total", t))
+
+if args.watch:
+	# --force only applies to the first build.
+	args.force = False
+	try:
+		watch(args, stages)
+	except KeyboardInterrupt:
+		pass
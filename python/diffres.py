@@ -0,0 +1,349 @@
+import argparse
+import hashlib
+import html
+import json
+import os
+import plistlib
+import re
+
+#
+# semantic diff of two generated resource trees (eg, before and after a
+# mame bump):
+#
+# python3 diffres.py old/Resources new/Resources [--json] [name ...]
+#
+# Files are compared by content hash first (the sha256 recorded in the build
+# manifest when it's still current, otherwise hashed here), so unchanged
+# plists are never parsed.  Changed plists in our own xml layout (plist.py:
+# one element per line, two spaces per level) are split into subtrees
+# textually; identical subtrees are matched by their bytes, and only what's
+# left is descended into or parsed.  Other plists (binary, or from another
+# writer) are loaded and walked the same way.  Catalog device trees are
+# compared by their content key.
+# Arrays of named things (slots, options, devices, software lists, rom sets)
+# are matched by name rather than position, so the changelog reads as
+#
+# apple2e
+#   + slots[sl4].options[mouse]  "Apple II Mouse Card"
+#   - software[apple2_flop_misc]
+#   ~ media.floppy_5_25: 2 -> 1
+#
+# Exits with 1 if anything changed (like diff).
+#
+
+
+def load_manifest(root):
+	# name -> mkmachines build manifest entry (only trusted while the file's
+	# size and mtime still match.)
+	try:
+		with open(root.rstrip("/") + ".manifest.json") as f:
+			machines = json.load(f).get('machines', {})
+	except FileNotFoundError:
+		return {}
+	return machines
+
+
+class Tree(object):
+	def __init__(self, root):
+		self.root = root
+		self.manifest = load_manifest(root)
+		self.catalog = {}
+		self.catalog_text = {}
+
+	def files(self):
+		# relative path -> absolute path, for the top level and software/
+		rv = {}
+		for d in ("", "software"):
+			p = os.path.join(self.root, d)
+			if not os.path.isdir(p): continue
+			for x in os.listdir(p):
+				if x.endswith(".plist"): rv[os.path.join(d, x[:-6])] = os.path.join(p, x)
+		return rv
+
+	def digest(self, name, path):
+		e = self.manifest.get(name)
+		if e:
+			st = os.stat(path)
+			if e.get('size') == st.st_size and e.get('mtime') == st.st_mtime_ns: return e['sha256']
+		with open(path, "rb") as f:
+			return hashlib.file_digest(f, 'sha256').hexdigest()
+
+	def read(self, path):
+		with open(path, "rb") as f:
+			return f.read()
+
+	def load(self, path):
+		with open(path, "rb") as f:
+			return plistlib.load(f)
+
+	def catalog_items(self, key, depth):
+		# dict_items of a catalog entry, as if it were inline at depth (None
+		# if it's not in plist.py's xml layout.)
+		k = (key, depth)
+		if k not in self.catalog_text:
+			x = root_element(self.read(os.path.join(self.root, "catalog", key + ".plist")))
+			if x is not None: x = dict_items(re.sub(rb'(?m)^(?=.)', b'  ' * (depth - 1), x), depth)
+			self.catalog_text[k] = x
+		return self.catalog_text[k]
+
+	def expand(self, items, depth):
+		# dict_items of a device, with a catalog entry filled in.
+		if 'catalog' not in items: return items
+		x = self.catalog_items(text(items['catalog']), depth)
+		if x is None: return None
+		return { 'name': items['name'], **x }
+
+	def device(self, d):
+		# a catalog device ({ name, catalog: key }) with its slot tree filled in.
+		key = d.get('catalog')
+		if key is None: return d
+		if key not in self.catalog:
+			self.catalog[key] = self.load(os.path.join(self.root, "catalog", key + ".plist"))
+		return { 'name': d['name'], **self.catalog[key] }
+
+
+def item_key(x):
+	if isinstance(x, str): return x.removesuffix(".xml")
+	if isinstance(x, dict):
+		for k in ('name', 'value', 'Name'):
+			v = x.get(k)
+			if isinstance(v, str): return v.removesuffix(".xml")
+		if 'description' in x and 'children' in x: return x['description'] # models.plist groups
+	return None
+
+def keyed(a):
+	# { key: item } for an array of named things, or None if it's not one.
+	rv = {}
+	for x in a:
+		k = item_key(x)
+		if k is None or k in rv: return None
+		rv[k] = x
+	return rv
+
+
+def summary(x):
+	if isinstance(x, Raw):
+		if tag(x.text) in (b'<dict>', b'<array>', b'<string>'):
+			d = x.description()
+			return json.dumps(d) if d else ""
+		x = x.value()
+	if isinstance(x, dict):
+		d = x.get('description') or x.get('Description')
+		return json.dumps(d) if d else ""
+	if isinstance(x, str): return ""
+	return json.dumps(x)
+
+def render(path):
+	rv = ""
+	for k in path:
+		if isinstance(k, tuple): rv += "[{}]".format(k[0])
+		else: rv += ("." if rv else "") + k
+	return rv
+
+
+#
+# text level -- elements are byte strings, each starting with its own
+# indentation and ending with a newline.
+#
+_header = b'<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" "http://www.apple.com/DTDs/PropertyList-1.0.dtd">\n<plist version="1.0">\n'
+_trailer = b'</plist>\n'
+_starts = {}
+
+def root_element(data):
+	# the root element, if data is in plist.py's xml layout.
+	if data.startswith(_header + b'  <') and data.endswith(_trailer):
+		return data[len(_header):-len(_trailer)]
+	return None
+
+def children(x, depth):
+	# child elements of a <dict> or <array> at depth (indented 2 * depth; keys
+	# are elements too.)
+	r = _starts.get(depth)
+	if r is None: r = _starts[depth] = re.compile(rb'\n {%d}<(?!/)' % (2 * depth + 2))
+	end = x.rindex(b'\n', 0, len(x) - 1) + 1 # closing tag
+	pos = [m.start() + 1 for m in r.finditer(x, 0, end)]
+	pos.append(end)
+	return [x[pos[i]:pos[i + 1]] for i in range(len(pos) - 1)]
+
+def tag(x):
+	return x[x.index(b'<'):x.index(b'>') + 1]
+
+def text(x):
+	return html.unescape(x[x.index(b'>') + 1:x.rindex(b'</')].decode('utf8'))
+
+def parse(x):
+	return plistlib.loads(b'<plist version="1.0">\n' + x + _trailer)
+
+class Raw(object):
+	# an added or removed element, parsed only if its value is needed.
+	__slots__ = ('text', 'depth')
+
+	def __init__(self, text, depth):
+		self.text = text
+		self.depth = depth
+
+	def value(self):
+		return parse(self.text)
+
+	def description(self):
+		if tag(self.text) != b'<dict>': return None
+		d = dict_items(self.text, self.depth)
+		x = d.get('description', d.get('Description'))
+		return text(x) if x and tag(x) == b'<string>' else None
+
+def dict_items(x, depth):
+	c = children(x, depth)
+	return { text(c[i]): c[i + 1] for i in range(0, len(c), 2) }
+
+_ids = {}
+
+def text_key(x, depth):
+	# item_key, from the text.
+	t = tag(x)
+	if t == b'<string>': return text(x).removesuffix(".xml")
+	if t != b'<dict>': return None
+	r = _ids.get(depth)
+	if r is None: r = _ids[depth] = re.compile(rb'^ {%d}<key>(name|value|Name)</key>\n {%d}<string>(.*)</string>$' % (2 * depth + 2, 2 * depth + 2), re.M)
+	found = { m[1]: m[2] for m in r.finditer(x) }
+	for k in (b'name', b'value', b'Name'):
+		if k in found: return html.unescape(found[k].decode('utf8')).removesuffix(".xml")
+	return None
+
+def diff_text(a, b, depth, path, out, ta, tb):
+	if a == b: return
+
+	t = tag(a)
+	if t != tag(b) or t not in (b'<dict>', b'<array>'):
+		out.append(('~', path, parse(a), parse(b)))
+		return
+
+	if t == b'<dict>':
+		da, db = dict_items(a, depth), dict_items(b, depth)
+		if 'catalog' in da or 'catalog' in db:
+			# catalog device ({ name, catalog: key }) -- the same key is the
+			# same tree, otherwise compare with the entries filled in.
+			if da.get('catalog') == db.get('catalog'): return
+			da, db = ta.expand(da, depth), tb.expand(db, depth)
+			if da is None or db is None:
+				diff(parse(a), parse(b), path, out, ta, tb)
+				return
+		for k, x in da.items():
+			if k not in db: out.append(('-', path + [k], Raw(x, depth + 1), None))
+			else: diff_text(x, db[k], depth + 1, path + [k], out, ta, tb)
+		for k, x in db.items():
+			if k not in da: out.append(('+', path + [k], None, Raw(x, depth + 1)))
+		return
+
+	# arrays: elements present (byte for byte) on both sides are set aside,
+	# the rest are matched by name.
+	ca, cb = children(a, depth), children(b, depth)
+	same = set(ca).intersection(cb)
+	ka, kb = {}, {}
+	for c, k in ((ca, ka), (cb, kb)):
+		for x in c:
+			if x in same: continue
+			n = text_key(x, depth + 1)
+			if n is None or n in k:
+				diff(parse(a), parse(b), path, out, ta, tb)
+				return
+			k[n] = x
+	for k, x in ka.items():
+		if k not in kb: out.append(('-', path + [(k,)], Raw(x, depth + 1), None))
+		else: diff_text(x, kb[k], depth + 1, path + [(k,)], out, ta, tb)
+	for k, x in kb.items():
+		if k not in ka: out.append(('+', path + [(k,)], None, Raw(x, depth + 1)))
+
+
+#
+# object level, for everything else.
+#
+def diff(a, b, path, out, ta, tb):
+	if a == b: return
+
+	if isinstance(a, dict) and isinstance(b, dict):
+		if 'catalog' in a or 'catalog' in b:
+			# content-addressed -- same key, same tree.
+			if a.get('catalog') is not None and a.get('catalog') == b.get('catalog'): return
+			a, b = ta.device(a), tb.device(b)
+			if a == b: return
+		for k in a:
+			if k not in b: out.append(('-', path + [k], a[k], None))
+			else: diff(a[k], b[k], path + [k], out, ta, tb)
+		for k in b:
+			if k not in a: out.append(('+', path + [k], None, b[k]))
+		return
+
+	if isinstance(a, list) and isinstance(b, list):
+		ka, kb = keyed(a), keyed(b)
+		if ka is not None and kb is not None:
+			for k, x in ka.items():
+				if k not in kb: out.append(('-', path + [(k,)], x, None))
+				else: diff(x, kb[k], path + [(k,)], out, ta, tb)
+			for k, x in kb.items():
+				if k not in ka: out.append(('+', path + [(k,)], None, x))
+			return
+
+	out.append(('~', path, a, b))
+
+
+def compare(old, new, names=None):
+	# [ (file, [ (op, path, old, new), ... ]), ... ] for the files that differ.
+	ta, tb = Tree(old), Tree(new)
+	fa, fb = ta.files(), tb.files()
+	rv = []
+	for name in sorted(set(fa) | set(fb)):
+		if names and name not in names: continue
+		if name not in fb:
+			rv.append((name, [('-', [], None, None)]))
+			continue
+		if name not in fa:
+			rv.append((name, [('+', [], None, None)]))
+			continue
+		if ta.digest(name, fa[name]) == tb.digest(name, fb[name]): continue
+
+		out = []
+		a, b = ta.read(fa[name]), tb.read(fb[name])
+		ra, rb = root_element(a), root_element(b)
+		if ra is not None and rb is not None: diff_text(ra, rb, 1, [], out, ta, tb)
+		else: diff(plistlib.loads(a), plistlib.loads(b), [], out, ta, tb)
+		if out: rv.append((name, out))
+	return rv
+
+
+def print_changes(changes):
+	for name, out in changes:
+		if out[0][1] == []:
+			print("{} {}".format(out[0][0], name))
+			continue
+		print(name)
+		for op, path, a, b in out:
+			if op == '~':
+				print("  ~ {}: {} -> {}".format(render(path), summary(a) or json.dumps(a), summary(b) or json.dumps(b)))
+			else:
+				s = summary(a if op == '-' else b)
+				print("  {} {}{}".format(op, render(path), "  " + s if s else ""))
+
+
+def json_changes(changes):
+	def jpath(path): return [k[0] if isinstance(k, tuple) else k for k in path]
+	def value(x): return x.value() if isinstance(x, Raw) else x
+	return [{ 'file': name, 'changes': [
+		{ 'op': op, 'path': jpath(path), **({ 'old': value(a) } if a is not None else {}), **({ 'new': value(b) } if b is not None else {}) }
+		for op, path, a, b in out
+	]} for name, out in changes]
+
+
+if __name__ == '__main__':
+	p = argparse.ArgumentParser()
+	p.add_argument('old', help='old resource directory')
+	p.add_argument('new', help='new resource directory')
+	p.add_argument('name', nargs="*", help='only compare these plists (eg, apple2e, software/apple2_flop_orig)')
+	p.add_argument('--json', action='store_true', help='print the changes as json')
+	args = p.parse_intermixed_args()
+
+	changes = compare(args.old, args.new, set(args.name))
+	if args.json:
+		print(json.dumps(json_changes(changes), indent="\t", default=str))
+	else:
+		print_changes(changes)
+	exit(1 if changes else 0)
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+#
+# synthetic MAME stand-in for benchmarking/testing the generators.
+#
+# answers -listxml, -listfull, -listslots, -listmedia and -version with a
+# deterministic, made-up machine/slot/device graph.  Point mame.py at it:
+#
+#   AMPLE_MAME=./fakemame.py python3 mkmachines.py
+#
+# The graph shape is controlled via environment variables:
+#
+#   FAKEMAME_MACHINES  number of drivers in the full list (default 250)
+#   FAKEMAME_DEVICES   number of slot card devices (default 400)
+#   FAKEMAME_SLOTS     top-level slots per machine (default 8)
+#   FAKEMAME_FANOUT    options per slot (default 12)
+#   FAKEMAME_DEPTH     nested slot depth of cards (default 2)
+#   FAKEMAME_SEED      random seed (default 0)
+#
+# Any machine name that isn't part of the synthetic set (eg, "apple2e") is
+# synthesized on demand from its name, so the real MACHINES tables work too.
+
+import os
+import random
+import sys
+import zlib
+import hashlib
+from xml.sax.saxutils import quoteattr, escape
+
+from machines import MACHINES_EXTRA, SLOTS, SLOT_NAMES
+
+
+def _env(name, default):
+	try: return int(os.environ.get(name, default))
+	except ValueError: return default
+
+NMACHINES = _env('FAKEMAME_MACHINES', 250)
+NDEVICES = _env('FAKEMAME_DEVICES', 400)
+NSLOTS = _env('FAKEMAME_SLOTS', 8)
+FANOUT = _env('FAKEMAME_FANOUT', 12)
+DEPTH = _env('FAKEMAME_DEPTH', 2)
+SEED = _env('FAKEMAME_SEED', 0)
+
+VERSION = "0.285 (synthetic)"
+
+# slot names which carry disk drives (see mkmachines.py:make_smartport)
+DRIVE_SLOTS = ["fdc:0", "fdc:1", "scsi:1", "scsi:6"]
+
+# option name -> (device type, interface, extensions)
+MEDIA_OPTIONS = {
+	"525": ("floppydisk", "floppy_5_25", ["dsk", "do", "po", "woz"]),
+	"35dd": ("floppydisk", "floppy_3_5", ["dsk", "2mg", "woz"]),
+	"harddisk": ("harddisk", "scsi_hdd", ["chd", "hd", "hdv", "2mg"]),
+	"cdrom": ("cdrom", "cdrom", ["chd", "cue", "iso"]),
+}
+
+CARD_WORDS = [
+	"Disk", "Serial", "Parallel", "Clock", "Mouse", "Memory", "Video", "SCSI",
+	"MIDI", "Sound", "Network", "Printer", "Modem", "Z80", "Accelerator", "Joystick",
+]
+
+
+def rng(*key):
+	h = zlib.crc32(repr((SEED,) + key).encode('utf8'))
+	return random.Random(h)
+
+
+def fake_hash(name):
+	d = hashlib.sha1(name.encode('utf8')).hexdigest()
+	return d[:8], d
+
+
+def device_name(i):
+	return "fdev{:04d}".format(i)
+
+def machine_name(i):
+	return "fake{:04d}".format(i)
+
+
+def device_depth(i):
+	# cards are layered so the slot graph is a DAG of bounded depth.
+	if DEPTH <= 0 or NDEVICES <= 0: return 0
+	return i * (DEPTH + 1) // NDEVICES
+
+
+def pick_devices(r, depth, count):
+	# devices strictly deeper than `depth`
+	lo = (depth * NDEVICES + DEPTH) // (DEPTH + 1)
+	lo = max(lo, 0)
+	if lo >= NDEVICES: return []
+	pool = range(lo, NDEVICES)
+	count = min(count, len(pool))
+	return sorted(r.sample(pool, count))
+
+
+class Node(object):
+	def __init__(self, name):
+		self.name = name
+		self.description = name
+		self.sourcefile = "synthetic/" + name + ".cpp"
+		self.isdevice = False
+		self.romof = None
+		self.cloneof = None
+		self.biossets = []
+		self.roms = []
+		self.device_refs = []
+		self.devices = []    # (type, tag, interface, brief, extensions)
+		self.slots = []      # (name, [(option, devname, default)])
+		self.ramoptions = [] # (name, bytes, default)
+		self.softwarelists = []
+		self.display = None
+
+
+def default_devices(n):
+	# as in mame, only what the default configuration instantiates is a
+	# device_ref; the other options are only named by their slotoption.
+	return [x[1] for s in n.slots for x in s[1] if x[2]]
+
+
+def make_card(i):
+	r = rng('dev', i)
+	name = device_name(i)
+	n = Node(name)
+	n.isdevice = True
+	n.description = "{} {} Card {}".format(r.choice(CARD_WORDS), r.choice(CARD_WORDS), i)
+	n.sourcefile = "synthetic/bus/card{:d}.cpp".format(i % 97)
+
+	if r.random() < 0.6:
+		for j in range(r.randint(1, 3)):
+			rname = "{}_{}.bin".format(name, j)
+			n.roms.append((rname, 1 << r.randint(8, 14)) + fake_hash(rname))
+
+	if r.random() < 0.1:
+		n.biossets = [("v{}".format(j), "Version {}".format(j)) for j in range(1, r.randint(2, 4))]
+
+	if r.random() < 0.15:
+		n.device_refs.append("bitbanger")
+
+	d = device_depth(i)
+	if d < DEPTH:
+		for s in range(r.randint(0, 2)):
+			devs = pick_devices(r, d + 1, max(1, FANOUT // 2))
+			if not devs: break
+			opts = [(device_name(x).replace("fdev", "c"), device_name(x), False) for x in devs]
+			opts[0] = (opts[0][0], opts[0][1], r.random() < 0.5)
+			n.slots.append(("port{}".format(s), opts))
+
+	if r.random() < 0.3:
+		# drive connectors, as in a disk controller
+		kind = r.choice(list(MEDIA_OPTIONS.keys()))
+		for j in range(r.randint(1, 2)):
+			n.slots.append(("{}".format(j), [(kind, "fake_{}".format(kind), True)]))
+
+	n.device_refs.extend(default_devices(n))
+	n.device_refs = list(dict.fromkeys(n.device_refs))
+	return n
+
+
+def make_drive(kind):
+	n = Node("fake_" + kind)
+	n.isdevice = True
+	typ, intf, ext = MEDIA_OPTIONS[kind]
+	n.description = "Synthetic {} drive".format(kind)
+	n.devices.append((typ, "", intf, kind, ext))
+	return n
+
+
+def make_machine(name):
+	r = rng('machine', name)
+	n = Node(name)
+	if name.startswith("fake"):
+		n.description = "Synthetic Computer {}".format(name[4:])
+	else:
+		n.description = "Synthetic {}".format(name)
+	n.sourcefile = "synthetic/{}.cpp".format(name.rstrip("0123456789") or name)
+
+	if name.startswith("fake"):
+		i = int(name[4:])
+		if i % 5:
+			n.cloneof = n.romof = machine_name(i - i % 5)
+
+	if not n.romof:
+		for j in range(r.randint(1, 4)):
+			rname = "{}_{}.rom".format(name, j)
+			n.roms.append((rname, 1 << r.randint(10, 16)) + fake_hash(rname))
+		if r.random() < 0.2:
+			n.biossets = [("rev{}".format(j), "Revision {}".format(j)) for j in range(r.randint(2, 3))]
+
+	n.display = (r.choice([280, 320, 512, 560, 640]), r.choice([192, 200, 256, 342, 480]))
+	n.ramoptions = [("{}K".format(k), k * 1024, k == 64) for k in (64, 128, 256) if r.random() < 0.8 or k == 64]
+
+	n.devices.append(("cassette", "cassette", "apple2_cass", "cass", ["wav"]))
+
+	slotnames = [x for x in SLOTS if ':' not in x and x in SLOT_NAMES]
+	for s in sorted(r.sample(slotnames, min(NSLOTS, len(slotnames))), key=slotnames.index):
+		devs = pick_devices(r, 0, FANOUT)
+		opts = [(device_name(x).replace("fdev", "c"), device_name(x), False) for x in devs]
+		if opts and r.random() < 0.3:
+			opts[0] = (opts[0][0], opts[0][1], True)
+		n.slots.append((s, opts))
+
+	for s in r.sample(DRIVE_SLOTS, r.randint(0, 2)):
+		kind = r.choice(list(MEDIA_OPTIONS.keys()))
+		n.slots.append((s, [(kind, "fake_" + kind, True)]))
+		typ, intf, ext = MEDIA_OPTIONS[kind]
+		n.devices.append((typ, s + ":" + kind, intf, kind, ext))
+
+	n.softwarelists = [("{}_flop".format(n.sourcefile[10:-4]), None)]
+	n.device_refs = list(dict.fromkeys(["m6502"] + default_devices(n)))
+	return n
+
+
+_nodes = {}
+
+def lookup(name):
+	if name in _nodes: return _nodes[name]
+
+	n = None
+	if name.startswith("fdev"):
+		try: i = int(name[4:])
+		except ValueError: i = -1
+		if 0 <= i < NDEVICES: n = make_card(i)
+	elif name.startswith("fake_") and name[5:] in MEDIA_OPTIONS:
+		n = make_drive(name[5:])
+	elif name in ("m6502", "bitbanger"):
+		n = Node(name)
+		n.isdevice = True
+		n.description = name.upper()
+	elif name:
+		n = make_machine(name)
+
+	_nodes[name] = n
+	return n
+
+
+def closure(names):
+	# the machines plus every device they (transitively) reference.
+	rv = []
+	seen = set()
+	pending = list(names)
+	while pending:
+		name = pending.pop(0)
+		if name in seen: continue
+		seen.add(name)
+		n = lookup(name)
+		if n is None: continue
+		rv.append(n)
+		pending.extend(n.device_refs)
+	return rv
+
+
+def write_machine(out, n):
+	w = out.write
+	attrs = ' name={} sourcefile={}'.format(quoteattr(n.name), quoteattr(n.sourcefile))
+	if n.isdevice: attrs += ' isdevice="yes" runnable="no"'
+	if n.cloneof: attrs += ' cloneof={}'.format(quoteattr(n.cloneof))
+	if n.romof: attrs += ' romof={}'.format(quoteattr(n.romof))
+	w('\t<machine{}>\n'.format(attrs))
+	w('\t\t<description>{}</description>\n'.format(escape(n.description)))
+	w('\t\t<year>1984</year>\n')
+	w('\t\t<manufacturer>Synthetic</manufacturer>\n')
+	for b in n.biossets:
+		w('\t\t<biosset name={} description={}/>\n'.format(quoteattr(b[0]), quoteattr(b[1])))
+	for rname, size, crc, sha1 in n.roms:
+		w('\t\t<rom name={} size="{}" crc="{}" sha1="{}" region="maincpu" offset="0"/>\n'.format(quoteattr(rname), size, crc, sha1))
+	for x in n.device_refs:
+		w('\t\t<device_ref name={}/>\n'.format(quoteattr(x)))
+	if not n.isdevice:
+		w('\t\t<chip type="cpu" tag="maincpu" name="M6502" clock="1023000"/>\n')
+	if n.display:
+		w('\t\t<display tag="screen" type="raster" rotate="0" width="{}" height="{}" refresh="60.000000" />\n'.format(*n.display))
+	if not n.isdevice:
+		w('\t\t<sound channels="1"/>\n')
+		w('\t\t<input players="1" coins="0">\n\t\t\t<control type="keyboard" player="1" buttons="0"/>\n\t\t</input>\n')
+		w('\t\t<port tag=":keyb_0">\n\t\t\t<analog mask="255"/>\n\t\t</port>\n')
+		w('\t\t<driver status="good" emulation="good" savestate="supported"/>\n')
+	for typ, tag, intf, brief, ext in n.devices:
+		tag = tag or brief
+		w('\t\t<device type={} tag={} interface={}>\n'.format(quoteattr(typ), quoteattr(tag), quoteattr(intf)))
+		w('\t\t\t<instance name={} briefname={}/>\n'.format(quoteattr(tag.replace(':', '_')), quoteattr(brief)))
+		for e in ext:
+			w('\t\t\t<extension name={}/>\n'.format(quoteattr(e)))
+		w('\t\t</device>\n')
+	for sname, opts in n.slots:
+		w('\t\t<slot name={}>\n'.format(quoteattr(sname)))
+		for oname, devname, default in opts:
+			d = ' default="yes"' if default else ''
+			w('\t\t\t<slotoption name={} devname={}{}/>\n'.format(quoteattr(oname), quoteattr(devname), d))
+		w('\t\t</slot>\n')
+	for sw, filter in n.softwarelists:
+		f = ' filter={}'.format(quoteattr(filter)) if filter else ''
+		w('\t\t<softwarelist tag={} name={} status="original"{}/>\n'.format(quoteattr(sw), quoteattr(sw), f))
+	for name, size, default in n.ramoptions:
+		d = ' default="yes"' if default else ''
+		w('\t\t<ramoption name={}{}>{}</ramoption>\n'.format(quoteattr(name), d, size))
+	w('\t</machine>\n')
+
+
+def all_machines():
+	return [*MACHINES_EXTRA, "vgmplay", *(machine_name(i) for i in range(NMACHINES))]
+
+
+def all_devices():
+	# the full list has every device, not just the ones a default
+	# configuration references.
+	return [*(device_name(i) for i in range(NDEVICES)), *("fake_" + x for x in MEDIA_OPTIONS), "m6502", "bitbanger"]
+
+
+def listxml(out, names):
+	nodes = closure(names or [*all_machines(), *all_devices()])
+	missing = [x for x in names if lookup(x) is None]
+	if missing:
+		sys.stderr.write('No matching machines found for \'{}\'\n'.format(missing[0]))
+		return 1
+
+	out.write('<?xml version="1.0"?>\n')
+	out.write('<mame build={} debug="no" mameconfig="10">\n'.format(quoteattr(VERSION)))
+	for n in nodes:
+		write_machine(out, n)
+	out.write('</mame>\n')
+	return 0
+
+
+def listfull(out, names):
+	out.write('Name:             Description:\n')
+	for name in names or all_machines():
+		n = lookup(name)
+		if n is None: continue
+		out.write('{:<17} "{}"\n'.format(n.name, n.description))
+	return 0
+
+
+def listslots(out, names):
+	out.write('SYSTEM           SLOT NAME        SLOT OPTIONS SUPPORTED\n')
+	out.write('---------------- ---------------- ----------------------------------------------\n')
+	for name in names or all_machines():
+		n = lookup(name)
+		if n is None: continue
+		first = True
+		for sname, opts in n.slots:
+			for k, (oname, devname, default) in enumerate(opts):
+				out.write('{:<16} {:<16} {:<16} {}\n'.format(
+					n.name if first else '', sname if k == 0 else '', oname, lookup(devname).description))
+				first = False
+		out.write('\n')
+	return 0
+
+
+def listmedia(out, names):
+	out.write('SYSTEM           MEDIA NAME       (brief)    IMAGE FILE EXTENSIONS SUPPORTED\n')
+	out.write('---------------- --------------------------- -------------------------------\n')
+	for name in names or all_machines():
+		n = lookup(name)
+		if n is None: continue
+		first = True
+		for typ, tag, intf, brief, ext in n.devices:
+			out.write('{:<16} {:<16} {:<10} {}\n'.format(
+				n.name if first else '', tag or brief, '(' + brief + ')', ' '.join('.' + e for e in ext)))
+			first = False
+	return 0
+
+
+def main(argv):
+	commands = {
+		'-listxml': listxml, '-lx': listxml,
+		'-listfull': listfull, '-ll': listfull,
+		'-listslots': listslots, '-lslot': listslots,
+		'-listmedia': listmedia, '-lm': listmedia,
+	}
+	cmd = None
+	names = []
+	for x in argv:
+		if x in commands: cmd = commands[x]
+		elif x == '-version':
+			sys.stdout.write(VERSION + '\n')
+			return 0
+		elif x.startswith('-'): continue # -nodtd, etc.
+		else: names.append(x)
+
+	if cmd is None:
+		sys.stderr.write('fakemame: unsupported command line: {}\n'.format(' '.join(argv)))
+		return 1
+
+	return cmd(sys.stdout, names)
+
+
+if __name__ == '__main__':
+	exit(main(sys.argv[1:]))
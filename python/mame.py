@@ -1,17 +1,379 @@
-
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import os
 import subprocess
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import timing
+
+
+env = {'DYLD_FALLBACK_FRAMEWORK_PATH': '../embedded'}
+path = os.environ.get('AMPLE_MAME', "../mame/mame-x64")
+
+timeout = 300 # seconds per call; None for no limit
+retries = 2 # extra attempts after a timeout or crash (not after an error exit)
+jobs = os.cpu_count() # concurrent mame processes in run_many
+
+
+class MameError(subprocess.CalledProcessError):
+	# a failed (or timed out) mame call.  returncode is None if it timed out.
+	def __init__(self, args, returncode, stderr=None, timed_out=False, attempts=1):
+		super().__init__(returncode, [path, *args], stderr=stderr)
+		self.timed_out = timed_out
+		self.attempts = attempts
+
+	def __str__(self):
+		what = "timed out" if self.timed_out else "exit status {}".format(self.returncode)
+		rv = "mame {}: {} ({} attempt{})".format(" ".join(self.cmd[1:]), what, self.attempts, "" if self.attempts == 1 else "s")
+		if self.stderr: rv += "\n" + self.stderr.strip()
+		return rv
+
+def _retry(e):
+	# timeouts and crashes (killed by a signal) may be transient; an error
+	# exit (unknown machine, etc) won't change.
+	return e.timed_out or e.returncode < 0
+
+
+#
+# result cache.  run() and listxml() output is stored gzipped under
+# CACHE_DIR, keyed by the mame binary (size, mtime and sha256) and the exact
+# arguments.  Least recently used entries are evicted past CACHE_LIMIT.
+#
+CACHE_DIR = "mame-cache"
+CACHE_LIMIT = 512 * 1024 * 1024
+
+cache = True # --no-cache
+refresh = False # --refresh: ignore (and replace) cached results
+
+
+def add_arguments(p):
+	p.add_argument('--mame', dest='mame_path', help='mame binary (default: $AMPLE_MAME or {})'.format(path))
+	p.add_argument('--mame-timeout', type=float, default=timeout, help='seconds per mame call (default {})'.format(timeout))
+	p.add_argument('--mame-jobs', type=int, default=jobs, help='concurrent mame processes (default {})'.format(jobs))
+	p.add_argument('--no-cache', dest='mame_cache', action='store_false', help='always run mame (don\'t use the result cache)')
+	p.add_argument('--refresh', dest='mame_refresh', action='store_true', help='run mame and replace cached results')
+
+def configure(args):
+	global path, timeout, jobs, cache, refresh
+	if args.mame_path: path = args.mame_path
+	timeout = args.mame_timeout or None
+	jobs = max(1, args.mame_jobs)
+	cache = args.mame_cache
+	refresh = args.mame_refresh
+
+def options():
+	# for passing the settings on to worker processes.
+	return (path, timeout, jobs, cache, refresh)
 
+def set_options(x):
+	global path, timeout, jobs, cache, refresh
+	path, timeout, jobs, cache, refresh = x
 
-def run(*args):
 
-	env = {'DYLD_FALLBACK_FRAMEWORK_PATH': '../embedded'}
-	path = "../embedded/mame64"
-	path = "../mame/mame-x64"
+_binary_key = None
 
-	st = subprocess.run([path, *args], capture_output=True, env=env, text=True, check=True)
+def binary_key():
+	# size, mtime and sha256 of the binary.  The hash is remembered (per
+	# size/mtime) in the cache directory so it isn't recomputed every run.
+	global _binary_key, _identity
+	if _binary_key: return _binary_key
 
-	#if st.returncode != 0:
-	#	print("mame error: {}".format(m))
-	#	exit(1)
+	st = os.stat(path)
+	stamp = [os.path.realpath(path), st.st_size, st.st_mtime_ns]
+	ipath = os.path.join(CACHE_DIR, "identity.json")
+	try:
+		with open(ipath) as f:
+			x = json.load(f)
+		if x['stamp'] == stamp: _identity = x['sha256']
+	except (FileNotFoundError, ValueError, KeyError):
+		pass
 
+	if _identity is None:
+		identity()
+		_write(ipath, json.dumps({ 'stamp': stamp, 'sha256': _identity }).encode('utf8'))
+
+	_binary_key = "{}:{}:{}".format(st.st_size, st.st_mtime_ns, _identity)
+	return _binary_key
+
+
+def _cache_path(args):
+	h = hashlib.sha256(binary_key().encode('utf8'))
+	for x in args: h.update(b'\0' + x.encode('utf8'))
+	return os.path.join(CACHE_DIR, h.hexdigest() + ".gz")
+
+def _write(p, data):
+	os.makedirs(CACHE_DIR, exist_ok=True)
+	tmp = "{}.{}.tmp".format(p, os.getpid())
+	with open(tmp, "wb") as f: f.write(data)
+	os.replace(tmp, p)
+
+def _lookup(args):
+	# cache path and whether it has a result to use.
+	if not cache: return None, False
+	p = _cache_path(args)
+	if refresh or not os.path.exists(p): return p, False
+	try:
+		os.utime(p) # lru
+	except FileNotFoundError:
+		return p, False
+	timing.count("mame cache hits")
+	return p, True
+
+_cache_size = None # bytes in the cache: the last scan, plus what's been stored since
+
+def evict(limit=None):
+	# drop least recently used entries until the cache fits.
+	global _cache_size
+	if limit is None: limit = CACHE_LIMIT
+	try:
+		entries = [e for e in os.scandir(CACHE_DIR) if e.name.endswith(".gz")]
+	except FileNotFoundError:
+		return
+	entries = [(st.st_mtime_ns, st.st_size, e.path) for e in entries for st in (e.stat(),)]
+	total = sum(x[1] for x in entries)
+	for mtime, size, p in sorted(entries):
+		if total <= limit: break
+		try:
+			os.remove(p)
+		except FileNotFoundError:
+			pass
+		total -= size
+	_cache_size = total
+
+def _stored(p):
+	# the directory is only rescanned on the first store and once the running
+	# total passes the limit (other processes' stores are picked up then.)
+	global _cache_size
+	if _cache_size is None:
+		evict()
+		return
+	_cache_size += os.path.getsize(p)
+	if _cache_size > CACHE_LIMIT: evict()
+
+
+def _run_once(args):
+	timing.count("mame subprocesses")
+	try:
+		with timing.stage("mame"):
+			st = subprocess.run([path, *args], capture_output=True, env=env, timeout=timeout)
+	except subprocess.TimeoutExpired:
+		raise MameError(args, None, timed_out=True)
+	if st.returncode != 0:
+		raise MameError(args, st.returncode, st.stderr.decode('utf8', 'replace'))
 	return st.stdout
+
+def _store(p, out):
+	if p:
+		_write(p, gzip.compress(out))
+		_stored(p)
+
+def run(*args, text=True):
+	# mame output (str, or bytes if not text.)  raises MameError.
+
+	p, hit = _lookup(args)
+	if hit:
+		with gzip.open(p, "rb") as f: out = f.read()
+		return out.decode('utf8') if text else out
+
+	for attempt in range(1, retries + 2):
+		try:
+			out = _run_once(args)
+			break
+		except MameError as e:
+			e.attempts = attempt
+			if attempt > retries or not _retry(e): raise
+			time.sleep(attempt)
+
+	_store(p, out)
+	return out.decode('utf8') if text else out
+
+
+#
+# asyncio runner: run_many() runs a batch of calls, at most `jobs` mame
+# processes at a time, each with the timeout and retry policy above.
+# Results come back in order; a failed call's slot holds its MameError.
+#
+
+async def _run_async(args, sem):
+	for attempt in range(1, retries + 2):
+		async with sem:
+			timing.count("mame subprocesses")
+			proc = await asyncio.create_subprocess_exec(path, *args, env=env,
+				stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+			try:
+				out, err = await asyncio.wait_for(proc.communicate(), timeout)
+				e = None
+				if proc.returncode != 0:
+					e = MameError(args, proc.returncode, err.decode('utf8', 'replace'), attempts=attempt)
+			except asyncio.TimeoutError:
+				proc.kill()
+				await proc.wait()
+				e = MameError(args, None, timed_out=True, attempts=attempt)
+
+		if e is None: return out
+		if attempt > retries or not _retry(e): raise e
+		await asyncio.sleep(attempt)
+
+async def run_many_async(arglists, text=True):
+	sem = asyncio.Semaphore(jobs)
+
+	async def one(args):
+		p, hit = _lookup(args)
+		if hit:
+			with gzip.open(p, "rb") as f: out = f.read()
+		else:
+			out = await _run_async(args, sem)
+			_store(p, out)
+		return out.decode('utf8') if text else out
+
+	return await asyncio.gather(*(one(tuple(x)) for x in arglists), return_exceptions=True)
+
+def run_many(arglists, text=True):
+	# [ output or MameError, ... ] for each argument list.
+	with timing.stage("mame"):
+		rv = asyncio.run(run_many_async(arglists, text))
+	for x in rv:
+		if isinstance(x, BaseException) and not isinstance(x, MameError): raise x
+	return rv
+
+def prefetch(arglists):
+	# warm the result cache for calls that will be made (one at a time) later.
+	if cache:
+		run_many([x for x in arglists if not _lookup(tuple(x))[1]], text=False)
+
+
+_version = None
+
+def version():
+	# the build string, as -listxml has it (<mame build="...">.)
+	global _version
+	if _version is None: _version = run("-version").strip()
+	return _version
+
+
+_identity = None
+
+def identity():
+	# sha256 of the mame binary (for build manifests.)
+	global _identity
+	if _identity is None:
+		with open(path, mode='rb') as f:
+			_identity = hashlib.file_digest(f, 'sha256').hexdigest()
+	return _identity
+
+
+def popen(*args):
+	# for streaming output (eg, -listxml); caller reads and waits.
+	timing.count("mame subprocesses")
+	return subprocess.Popen([path, *args], stdout=subprocess.PIPE, env=env)
+
+
+class _Reader(object):
+	# file wrapper that counts what's read (for --profile), optionally
+	# keeping a copy.  A tee under _machines' own reader doesn't count.
+	def __init__(self, f, copy=None, count=True):
+		self.f = f
+		self.copy = copy
+		self.count = count
+
+	def read(self, n=-1):
+		x = self.f.read(n)
+		if self.copy: self.copy.write(x)
+		if self.count: timing.count("xml bytes parsed", len(x))
+		return x
+
+
+# <machine> children the generators never look at.  they're dropped as
+# each machine is parsed.
+UNUSED = set((
+	'chip', 'sound', 'input', 'dipswitch', 'configuration', 'port',
+	'adjuster', 'driver', 'feature', 'sample', 'disk',
+))
+
+def parse_listxml(data):
+	# the <machine> elements of -listxml output (bytes).
+	return _machines(io.BytesIO(data))
+
+def _machines(f):
+	root = None
+	for event, x in ET.iterparse(_Reader(f), events=('start', 'end')):
+		if event == 'start':
+			if root is None: root = x
+			continue
+		if x.tag != 'machine': continue
+
+		for child in [c for c in x if c.tag in UNUSED]:
+			x.remove(child)
+		root.clear()
+		yield x
+
+def listxml(*names):
+	# stream -listxml output straight from the pipe, yielding each <machine>
+	# element as it's completed.  The document root is cleared as we go so
+	# only the machines the caller keeps stay alive.  The output is cached
+	# (as it streams) once it's been read to the end.  A timeout or crash is
+	# retried like run(), as long as no machine has been yielded yet.
+
+	args = (*names, "-listxml")
+	p, hit = _lookup(args)
+	if hit:
+		with gzip.open(p, "rb") as f:
+			yield from _machines(f)
+		return
+
+	for attempt in range(1, retries + 2):
+		started = False
+		g = _listxml_once(args, p)
+		try:
+			for x in g:
+				started = True
+				yield x
+			return
+		except MameError as e:
+			e.attempts = attempt
+			if started or attempt > retries or not _retry(e): raise
+		finally:
+			g.close()
+		time.sleep(attempt)
+
+def _listxml_once(args, p):
+	proc = popen(*args)
+	f = proc.stdout
+	# a hung mame is killed (and reported as timed out) rather than blocking.
+	watchdog = None
+	if timeout:
+		watchdog = threading.Timer(timeout, proc.kill)
+		watchdog.start()
+	if p:
+		tmp = "{}.{}.tmp".format(p, os.getpid())
+		os.makedirs(CACHE_DIR, exist_ok=True)
+		copy = gzip.open(tmp, "wb")
+		f = _Reader(f, copy, count=False)
+	complete = False
+	error = None
+	try:
+		yield from _machines(f)
+		complete = True
+	except ET.ParseError as e:
+		error = e # truncated output if mame died; reported from the exit status.
+	finally:
+		proc.stdout.close()
+		st = proc.wait()
+		timed_out = watchdog is not None and not watchdog.is_alive() and st < 0
+		if watchdog: watchdog.cancel()
+		if p:
+			copy.close()
+			if complete and st == 0:
+				os.replace(tmp, p)
+				_stored(p)
+			else:
+				os.remove(tmp)
+
+	if st != 0:
+		raise MameError(args, None if timed_out else st, timed_out=timed_out)
+	if error: raise error
@@ -0,0 +1,286 @@
+
+#
+# persistent sqlite store of mame -listxml data.
+#
+# python3 mamedb.py [--db mame.db] [--mame path] [--force]
+#
+# runs mame -listxml once (streaming) and stores the machines in normalized
+# tables, keyed by the mame build.  The generators (mkmachines, mkroms,
+# mkdevices) accept --db mame.db and query it instead of running mame.
+#
+
+import argparse
+import sqlite3
+import xml.etree.ElementTree as ET
+
+import mame
+
+DEFAULT_PATH = "mame.db"
+
+
+MACHINE_ATTRS = (
+	'name', 'sourcefile', 'isbios', 'isdevice', 'ismechanical', 'runnable',
+	'cloneof', 'romof', 'sampleof',
+)
+
+# child tag, table, attributes.  rows are keyed by (build, machine, seq)
+# where seq is the position within the machine.
+CHILDREN = (
+	('biosset', 'biossets', ('name', 'description', 'default')),
+	('rom', 'roms', ('name', 'bios', 'size', 'crc', 'sha1', 'merge', 'region', 'status', 'optional')),
+	('device_ref', 'device_refs', ('name',)),
+	('display', 'displays', ('tag', 'type', 'rotate', 'width', 'height', 'refresh')),
+	('device', 'devices', ('type', 'tag', 'interface', 'fixed_image', 'mandatory')),
+	('slot', 'slots', ('name',)),
+	('softwarelist', 'softwarelists', ('tag', 'name', 'status', 'filter')),
+	('ramoption', 'ramoptions', ('name', 'default')),
+)
+
+# nested children: parent table, child tag, table, attributes.
+NESTED = (
+	('slots', 'slotoption', 'slotoptions', ('name', 'devname', 'default')),
+	('devices', 'instance', 'device_instances', ('name', 'briefname')),
+	('devices', 'extension', 'device_extensions', ('name',)),
+)
+
+
+def _columns(attrs):
+	return ", ".join('"{}"'.format(x) for x in attrs)
+
+def _schema():
+	rv = [
+		'create table if not exists builds (id integer primary key, version text unique not null)',
+		'create table if not exists machines (build integer not null, {}, description, year, manufacturer, primary key (build, name))'.format(_columns(MACHINE_ATTRS)),
+	]
+
+	for tag, table, attrs in CHILDREN:
+		extra = ", value" if tag == 'ramoption' else ""
+		rv.append('create table if not exists {} (build integer not null, machine text not null, seq integer not null, {}{}, primary key (build, machine, seq))'.format(table, _columns(attrs), extra))
+
+	for parent, tag, table, attrs in NESTED:
+		rv.append('create table if not exists {} (build integer not null, machine text not null, parent integer not null, seq integer not null, {}, primary key (build, machine, parent, seq))'.format(table, _columns(attrs)))
+
+	# reverse lookups
+	rv.append('create index if not exists slotoptions_devname on slotoptions (build, devname)')
+	rv.append('create index if not exists device_refs_name on device_refs (build, name)')
+	return rv
+
+
+def _attrs(names, values):
+	return { k: v for k, v in zip(names, values) if v is not None }
+
+
+class MameDB(object):
+
+	def __init__(self, path=DEFAULT_PATH, version=None):
+		self.path = path
+		self.conn = sqlite3.connect(path)
+		for x in _schema(): self.conn.execute(x)
+		self.build = None
+		self.version = None
+		self.select(version)
+
+	def close(self):
+		self.conn.close()
+
+
+	def versions(self):
+		return [x[0] for x in self.conn.execute('select version from builds order by id')]
+
+	def select(self, version=None):
+		# version None -> most recently ingested build.
+		if version is None:
+			row = self.conn.execute('select id, version from builds order by id desc limit 1').fetchone()
+		else:
+			row = self.conn.execute('select id, version from builds where version = ?', (version,)).fetchone()
+		if row is None and version is not None:
+			raise KeyError("mamedb: no such build: {}".format(version))
+		self.build, self.version = row if row else (None, None)
+
+
+	def ingest(self, source, force=False):
+		# source is a file object with -listxml output.
+		# returns the version, or None if already ingested and not forced.
+
+		conn = self.conn
+		build = None
+		version = None
+
+		# raises ET.ParseError (with nothing stored) if the output is truncated.
+		try:
+			for event, x in ET.iterparse(source, events=('start', 'end')):
+				if event == 'start':
+					if x.tag == 'mame' and build is None:
+						version = x.get('build', 'unknown')
+						row = conn.execute('select id from builds where version = ?', (version,)).fetchone()
+						if row and not force:
+							self.select(version)
+							return None
+						if row: self._drop(row[0])
+						build = conn.execute('insert into builds (version) values (?)', (version,)).lastrowid
+						root = x
+					continue
+
+				if x.tag != 'machine': continue
+				self._insert(build, x)
+				root.clear()
+		except ET.ParseError:
+			conn.rollback()
+			raise
+
+		conn.commit()
+		self.select(version)
+		return version
+
+	def _drop(self, build):
+		tables = ['machines', 'builds']
+		tables.extend(x[1] for x in CHILDREN)
+		tables.extend(x[2] for x in NESTED)
+		for t in tables:
+			col = 'id' if t == 'builds' else 'build'
+			self.conn.execute('delete from {} where {} = ?'.format(t, col), (build,))
+
+	def _insert(self, build, m):
+		conn = self.conn
+		name = m.get('name')
+
+		values = [build, *(m.get(x) for x in MACHINE_ATTRS), m.findtext('description'), m.findtext('year'), m.findtext('manufacturer')]
+		conn.execute('insert into machines values ({})'.format(", ".join("?" * len(values))), values)
+
+		seq = {}
+		for child in m:
+			tag = child.tag
+			spec = _child_spec.get(tag)
+			if spec is None: continue
+			table, attrs = spec
+			n = seq.get(tag, 0)
+			seq[tag] = n + 1
+
+			values = [build, name, n, *(child.get(x) for x in attrs)]
+			if tag == 'ramoption': values.append(child.text)
+			conn.execute(_insert_sql[table], values)
+
+			for k, sub in enumerate(x for x in child if (table, x.tag) in _nested_spec):
+				subtable, subattrs = _nested_spec[(table, sub.tag)]
+				conn.execute(_insert_sql[subtable], [build, name, n, k, *(sub.get(x) for x in subattrs)])
+
+
+	def names(self, isdevice=None):
+		if isdevice is None:
+			rows = self.conn.execute('select name from machines where build = ? order by name', (self.build,))
+		else:
+			rows = self.conn.execute('select name from machines where build = ? and isdevice is {} order by name'.format("'yes'" if isdevice else "null"), (self.build,))
+		return [x[0] for x in rows]
+
+
+	def machine(self, name):
+		# rebuild the <machine> element (minus the parts we don't store).
+		conn = self.conn
+		build = self.build
+
+		row = conn.execute('select {}, description, year, manufacturer from machines where build = ? and name = ?'.format(_columns(MACHINE_ATTRS)), (build, name)).fetchone()
+		if row is None: return None
+
+		n = len(MACHINE_ATTRS)
+		m = ET.Element('machine', _attrs(MACHINE_ATTRS, row[:n]))
+		for tag, text in zip(('description', 'year', 'manufacturer'), row[n:]):
+			if text is not None: ET.SubElement(m, tag).text = text
+
+		for tag, table, attrs in CHILDREN:
+			extra = ", value" if tag == 'ramoption' else ""
+			nested = [x for x in NESTED if x[0] == table]
+			children = {}
+			for row in conn.execute('select seq, {}{} from {} where build = ? and machine = ? order by seq'.format(_columns(attrs), extra, table), (build, name)):
+				x = ET.SubElement(m, tag, _attrs(attrs, row[1:]))
+				if extra: x.text = row[-1]
+				children[row[0]] = x
+
+			for parent, subtag, subtable, subattrs in nested:
+				for row in conn.execute('select parent, {} from {} where build = ? and machine = ? order by parent, seq'.format(_columns(subattrs), subtable), (build, name)):
+					ET.SubElement(children[row[0]], subtag, _attrs(subattrs, row[1:]))
+
+		return m
+
+
+	def references(self, name):
+		# devices the default configuration instantiates (device_refs); other
+		# slot options aren't part of mame -listxml name.
+		conn = self.conn
+		return [x[0] for x in conn.execute('select name from device_refs where build = ? and machine = ? order by seq', (self.build, name))]
+
+
+	def listxml(self, *names, exclude=()):
+		# equivalent of mame -listxml name... -- the machines plus every
+		# device they reference.  machines in exclude are walked but not
+		# returned.
+		root = ET.Element('mame', { 'build': self.version or '' })
+		seen = set()
+		pending = list(names)
+		while pending:
+			name = pending.pop(0)
+			if name in seen: continue
+			seen.add(name)
+			pending.extend(self.references(name))
+			if name in exclude: continue
+			m = self.machine(name)
+			if m is not None: root.append(m)
+		return root
+
+
+_child_spec = { tag: (table, attrs) for tag, table, attrs in CHILDREN }
+_nested_spec = { (parent, tag): (table, attrs) for parent, tag, table, attrs in NESTED }
+_insert_sql = {}
+for tag, table, attrs in CHILDREN:
+	n = 3 + len(attrs) + (1 if tag == 'ramoption' else 0)
+	_insert_sql[table] = 'insert into {} values ({})'.format(table, ", ".join("?" * n))
+for parent, tag, table, attrs in NESTED:
+	_insert_sql[table] = 'insert into {} values ({})'.format(table, ", ".join("?" * (4 + len(attrs))))
+
+
+def open_db(path):
+	# the build matching the configured mame binary; the latest one only if
+	# there's no binary to ask.
+	db = MameDB(path)
+	if db.build is None:
+		db.close()
+		raise ValueError("mamedb: {} is empty; run mamedb.py first".format(path))
+	try:
+		version = mame.version()
+	except (OSError, mame.MameError):
+		return db
+	if version not in db.versions():
+		db.close()
+		raise ValueError("mamedb: {} has no data for mame {}; run mamedb.py first".format(path, version))
+	db.select(version)
+	return db
+
+
+if __name__ == '__main__':
+
+	p = argparse.ArgumentParser()
+	p.add_argument('--db', default=DEFAULT_PATH, help='database path (default: {})'.format(DEFAULT_PATH))
+	p.add_argument('--force', action='store_true', help='re-ingest even if this mame version is present')
+	mame.add_arguments(p)
+	args = p.parse_args()
+	mame.configure(args)
+
+	db = MameDB(args.db)
+	proc = mame.popen("-listxml")
+	error = None
+	try:
+		version = db.ingest(proc.stdout, args.force)
+		if version is None: proc.kill()
+	except ET.ParseError as e:
+		version, error = "", e # truncated output if mame died; reported from the exit status.
+	proc.stdout.close()
+	st = proc.wait()
+
+	if version is None:
+		print("{}: already ingested".format(db.version))
+	elif st != 0 or error:
+		print("mame error: -listxml ({})".format("exit status {}".format(st) if st else error))
+		db.close()
+		exit(1)
+	else:
+		print("{}: {} machines".format(version, len(db.names())))
+	db.close()
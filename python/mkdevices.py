@@ -1,25 +1,47 @@
 
-import subprocess
+import argparse
 
-from plist import to_plist
+from plist import write_plist, FORMATS
 
 import xml.etree.ElementTree as ET
 
 from machines import MACHINES
+import mame
+import mamedb
+import timing
 
 
+p = argparse.ArgumentParser()
+p.add_argument('--db', help='use a mamedb database instead of running mame')
+p.add_argument('--format', choices=FORMATS, default='xml', help='plist format (default xml)')
+mame.add_arguments(p)
+timing.add_arguments(p)
+args = p.parse_args()
+mame.configure(args)
+timing.configure(args)
+
+db = None
+if args.db: db = mamedb.open_db(args.db)
+
 devices = {}
+seen = set() # already returned by db.listxml, with everything they reference
 
 for m in MACHINES:
 
 
-	st = subprocess.run(["mame", m, "-listxml"], capture_output=True)
-	if st.returncode != 0:
-		print("mame error: {}".format(m))
-		exit(1)
+	with timing.stage("listxml", m):
+		if db:
+			root = db.listxml(m, exclude=seen)
+			seen.update(x.get("name") for x in root)
+		else:
+			try:
+				xml = mame.run(m, "-listxml", text=False)
+			except mame.MameError as e:
+				print("mame error: {}".format(e))
+				exit(1)
 
-	xml = st.stdout
-	root = ET.fromstring(xml)
+			timing.count("xml bytes parsed", len(xml))
+			root = ET.fromstring(xml)
 
 	nodes = root.findall("machine[@isdevice='yes']")
 	for d in nodes:
@@ -34,5 +56,5 @@ for m in MACHINES:
 		devices[name] = tmp
 
 
-with open("../Ample/Resources/devices.plist", "w") as f:
-	f.write(to_plist(devices))
+with timing.stage("write"):
+	write_plist(devices, "../Ample/Resources/devices.plist", args.format)
@@ -1,14 +1,22 @@
 import argparse
+import filecmp
+import functools
 import hashlib
+import json
+import os
+import types
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from copy import deepcopy
-from plist import to_plist
+from plist import write_plist, FORMATS
+import plist
 import re
 
-import xml.etree.ElementTree as ET
-
 from machines import MACHINES, MACHINES_EXTRA, SLOTS, SLOT_NAMES
 import mame
+import mamedb
+import model
+import timing
 
 # macintosh errata:
 # maclc has scsi:1 - scsi:7 and lcpds slots, but none are currently configurable.
@@ -70,8 +78,16 @@ DISABLED = set((
 
 
 
-machine_cache = {}
+machine_cache = {} # name -> model.Machine (None if mame doesn't know it)
 submachines = {} # with slots.
+subtree = set() # every machine reached by load_machine_recursive
+db = None # mamedb, if --db
+
+
+def cache_machine(name, m):
+	# a replaced entry can change any media result that reaches it.
+	if name in machine_cache and machine_cache[name] is not m: media_cache.clear()
+	machine_cache[name] = m
 
 
 def load_machine(name):
@@ -79,17 +95,61 @@ def load_machine(name):
 	rootname = name
 	if name in machine_cache: return machine_cache[name]
 
-	xml = mame.run(name, "-listxml")
-	root = ET.fromstring(xml)
+	if db:
+		cache_machine(name, model.from_element(db.machine(name)))
+		return machine_cache[name]
 
-	for x in root.findall("./machine"):
+	for x in mame.listxml(name):
 		name = x.get("name")
 		if name in machine_cache: continue
-		machine_cache[name] = x
+		cache_machine(name, model.Machine(x))
 
 	return machine_cache[rootname]
 
 
+# names per -listxml invocation when fetching a wave of devices.
+LISTXML_BATCH = 64
+
+def load_machines(names):
+	# fetch every uncached name with as few mame invocations as possible.
+	# mame fails the whole call if any name is unknown; in that case the
+	# batch is split so the bad name is isolated (and reported as missing.)
+
+	names = sorted(x for x in names if x not in machine_cache)
+	if not names: return
+
+	if db:
+		for x in names: cache_machine(x, model.from_element(db.machine(x)))
+		return
+
+	# batches run concurrently, each streamed (and parsed) as mame writes it,
+	# so only the compact models are held, not the xml.
+	chunks = [names[i:i + LISTXML_BATCH] for i in range(0, len(names), LISTXML_BATCH)]
+	with ThreadPoolExecutor(mame.jobs) as ex:
+		results = ex.map(load_chunk, chunks)
+		for chunk, rv in zip(chunks, results):
+			if isinstance(rv, mame.MameError):
+				if rv.timed_out: raise rv
+				if len(chunk) == 1:
+					cache_machine(chunk[0], None)
+					continue
+				half = len(chunk) // 2
+				load_machines(chunk[:half])
+				load_machines(chunk[half:])
+				continue
+
+			for x in rv:
+				if x.name in machine_cache: continue
+				cache_machine(x.name, x)
+
+def load_chunk(names):
+	# models for one -listxml call, or its MameError.
+	try:
+		return [model.Machine(x) for x in mame.listxml(*names)]
+	except mame.MameError as e:
+		return e
+
+
 def load_machine_recursive(name):
 	# machine_cache.clear()
 	submachines.clear()
@@ -98,37 +158,62 @@ def load_machine_recursive(name):
 	m = load_machine(name)
 	if m is None: return None
 
+	# breadth first, one wave (and one mame call) per level of the slot tree.
 	processed = set()
 	pending = { rootname }
 	while pending:
 
-		name = pending.pop()
-		m = load_machine(name)
-		processed.add(name)
-		if m is None:
-			print("    *{}".format(name))
-			continue
-		count = 0
-		for x in m.findall('./slot/slotoption'):
-			count = count+1
-			devname = x.get('devname')
-			if devname in processed: continue
-			pending.add(devname)
+		load_machines(pending)
+		frontier = set()
+		for name in pending:
+			m = machine_cache.get(name)
+			processed.add(name)
+			if m is None:
+				print("    *{}".format(name))
+				continue
+			count = 0
+			for x in m.slot_options():
+				count = count+1
+				devname = x.devname
+				if devname in processed: continue
+				frontier.add(devname)
 
-		# also include if there's a bios...
-		if m.find('./biosset') is not None: count = count + 1
+			# also include if there's a bios...
+			if m.biossets: count = count + 1
 
-		if count:
-			# print("    slots: {}".format(name))
-			submachines[name] = m
+			if count:
+				# print("    slots: {}".format(name))
+				submachines[name] = m
+
+		pending = frontier - processed
 
 
 	if rootname in submachines:
 		del submachines[rootname]
 
+	subtree.clear()
+	subtree.update(processed)
+
 	return machine_cache[rootname]
 
 
+# <device> interface (or type, if it has none) -> media
+MEDIA_INTERFACES = {
+	"cassette": "cass",
+	"apple1_cass": "cass",
+	"apple2_cass": "cass",
+	"floppy_5_25": "floppy_5_25",
+	"floppy_3_5": "floppy_3_5",
+	"floppy_8": "floppy_8", # pdp-11, etc
+	# mac
+	"scsi_hdd": "hard",
+	"cdrom": "cdrom",
+
+	# bbc
+	"bbc_rom": "rom", # bbc rom slot 0-3
+	"bbc_cass": "cass",
+}
+
 def find_machine_media(parent):
 	# look for relevant device nodes.  If the tag contains a slot, skip since it's
 	# not built in. Except the Apple3, where the floppy drives are actually slots 0/1/2/3/4
@@ -144,30 +229,13 @@ def find_machine_media(parent):
 	# pdp11 "floppydisk" is an 8" floppy.
 
 
-	mname = parent.get("name")
-
-
+	mname = parent.name
 
-	remap = {
-		"cassette": "cass",
-		"apple1_cass": "cass",
-		"apple2_cass": "cass",
-		"floppy_5_25": "floppy_5_25",
-		"floppy_3_5": "floppy_3_5",
-		"floppy_8": "floppy_8", # pdp-11, etc
-		# mac
-		"scsi_hdd": "hard",
-		"cdrom": "cdrom",
-
-		# bbc
-		"bbc_rom": "rom", # bbc rom slot 0-3
-		"bbc_cass": "cass",
-	}
 	media = {}
-	for x in parent.findall("./device"):
-		tag = x.get("tag")
-		typ = x.get("type")
-		intf = x.get("interface")
+	for x in parent.devices:
+		tag = x.tag
+		typ = x.type
+		intf = x.interface
 		if intf == None: intf = typ # cassette has no interface.
 
 
@@ -183,15 +251,15 @@ def find_machine_media(parent):
 		# skip slot devices -- they'll be handled as part of the device.
 		if slot: continue
 
-		if intf in remap:
-			name = remap[intf]
+		if intf in MEDIA_INTERFACES:
+			name = MEDIA_INTERFACES[intf]
 			media[name] = media.get(name, 0) + 1
 
 	# mac - scsi:3 / scsibus:3 are not in the xml but are hardcoded cd-rom drives.
 	# check for undeclared cd-rom
 	slotlist = set()
-	for x in parent.findall("./slot"):
-		slotname = split2(x.get("name"))
+	for x in parent.slots:
+		slotname = split2(x.name)
 		slotlist.add(slotname)
 
 	# print(slotlist)
@@ -206,6 +274,29 @@ def find_machine_media(parent):
 
 
 
+#
+# media for a device only depends on the device (and what it reaches), so
+# results are shared by every machine that has the card.  Keyed by
+# (function, devname, flag); cleared if a machine_cache entry is replaced.
+# Callers must not modify the returned dicts.
+#
+media_cache = {}
+media_stats = { 'hits': 0, 'misses': 0 }
+
+def media_memo(fn):
+	@functools.wraps(fn)
+	def memo(machine, flag=False):
+		key = (fn.__name__, machine.name, flag)
+		if key in media_cache:
+			media_stats['hits'] += 1
+			return media_cache[key]
+		media_stats['misses'] += 1
+		rv = media_cache[key] = fn(machine, flag)
+		return rv
+	return memo
+
+
+@media_memo
 def find_media(parent, include_slots=False):
 
 	# not strictly correct since they could have different extensions.
@@ -246,8 +337,7 @@ def find_media(parent, include_slots=False):
 
 	media = {}
 	# floppies
-	for x in parent.findall("./device_ref"):
-		name = x.get("name")
+	for name in parent.device_refs:
 		if name in remap_dev:
 			name = remap_dev[name]
 			media[name] = media.get(name, 0) + 1
@@ -266,10 +356,10 @@ def find_media(parent, include_slots=False):
 
 	if not include_slots: return media
 
-	for x in parent.findall("./slot/slotoption"):
-		if x.get("default") != "yes": continue
-		name = x.get("name")
-		devname = x.get("devname")
+	for x in parent.slot_options():
+		if not x.default: continue
+		name = x.name
+		devname = x.devname
 		if name in remap_slot:
 			name = remap_slot[name]
 			media[name] = media.get(name, 0) + 1
@@ -279,8 +369,8 @@ def find_media(parent, include_slots=False):
 	# n.b. - floppies are 5.25" 360k or 180k.  not bootable, not usable from prodos
 	# without special prodos file or loading driver into pc transporter ram.
 
-	name = parent.get("name")
-	sourcefile = parent.get("sourcefile")
+	name = parent.name
+	sourcefile = parent.sourcefile
 	if name == "pcxport":
 		media["floppy_5_25"] = media.get("floppy_5_25", 0) + 2
 
@@ -313,14 +403,51 @@ def find_media(parent, include_slots=False):
 
 
 def one_software(x):
-	xml = x.get("name") + ".xml"
-	filter = x.get("filter")
+	xml = x.name + ".xml"
+	filter = x.filter
 	if filter: return { "name": xml, "filter": filter }
 	return xml
 
 def find_software(parent):
-	swl = parent.findall("./softwarelist")
-	return [one_software(x) for x in swl]
+	return [one_software(x) for x in parent.softwarelists]
+
+
+#
+# file extensions each media type accepts, from the <device> nodes of the
+# machine and of every device it can reach (so slot options that aren't
+# the default count too.)  A device is matched on its interface, then on
+# the last part of its tag (the drive option, eg "sl6:diskiing:0:525"),
+# then on its type.  Devices that don't map to a media type are ignored.
+#
+MEDIA_TYPES = {
+	"cassette": "cass",
+	"harddisk": "hard",
+	"cdrom": "cdrom",
+	"bitbanger": "bitbanger",
+	"picture": "picture",
+	"midiin": "midiin",
+	"midiout": "midiout",
+}
+
+def device_media_type(x):
+	intf = x.interface or x.type
+	if intf in MEDIA_INTERFACES: return MEDIA_INTERFACES[intf]
+	name = (x.tag or "").split(":")[-1]
+	if name in DEVICE_MEDIA: return DEVICE_MEDIA[name]
+	return MEDIA_TYPES.get(x.type)
+
+def find_extensions():
+	rv = {}
+	for name in subtree:
+		m = machine_cache.get(name)
+		if m is None: continue
+		for x in m.devices:
+			if not x.extensions: continue
+			media = device_media_type(x)
+			if media: rv.setdefault(media, set()).update(e.lower() for e in x.extensions)
+
+	if not rv: return None
+	return { k: sorted(v) for k, v in sorted(rv.items()) }
 
 
 
@@ -405,7 +532,8 @@ def default_device_media(machine):
 
 	media = {}
 
-	for option in machine.findall("./slot/slotoption[@default='yes']"):
+	for option in machine.slot_options():
+		if not option.default: continue
 		m = slot_option_media(option, False)
 		if not m: continue
 		for k,v in m.items():
@@ -415,16 +543,21 @@ def default_device_media(machine):
 	return None
 
 def slot_option_media(option, recurse):
-	name = option.get('name')
-	devname = option.get('devname')
+	name = option.name
+	devname = option.devname
 
 	if name in DEVICE_MEDIA: return { DEVICE_MEDIA[name]: 1 }
 
 	if devname: device = machine_cache[devname]
 	if device is None: return None
 
-	if device.find("./device_ref[@name='bitbanger']") != None: return { 'bitbanger': 1 }
-	if device.find("./device_ref[@name='picture_image']") != None: return { 'picture': 1 }
+	return device_media(device, recurse)
+
+@media_memo
+def device_media(device, recurse):
+
+	if device.has_device_ref('bitbanger'): return { 'bitbanger': 1 }
+	if device.has_device_ref('picture_image'): return { 'picture': 1 }
 
 	if recurse: return default_device_media(device)
 	return None
@@ -439,9 +572,9 @@ def make_device_options(slot):
 	options = []
 	has_default = False
 	#has_media = False
-	for option in slot.findall("./slotoption"):
-		name = option.get("name")
-		devname = option.get("devname")
+	for option in slot.options:
+		name = option.name
+		devname = option.devname
 
 		if name in DEVICE_EXCLUDE: continue
 
@@ -450,12 +583,12 @@ def make_device_options(slot):
 		if name in DEVICE_REMAP:
 			desc = DEVICE_REMAP[name]
 		elif device is not None:
-			desc = device.find("description").text
+			desc = device.description
 		else:
 			# print("{} - {}".format(name, devname))
 			continue
 
-		default = option.get("default") == "yes"
+		default = option.default
 		has_default |= default
 		media = None
 
@@ -489,12 +622,12 @@ def split2(x):
 	# given a machine, return a list of slotoptions.
 def make_device_slots(machine):
 
-	# print("make_device_slots", machine.get("name"))
-	mname = machine.get('name')
+	# print("make_device_slots", machine.name)
+	mname = machine.name
 
 	slots = []
-	for slot in machine.findall('./slot'):
-		slotname = slot.get("name")
+	for slot in machine.slots:
+		slotname = slot.name
 		options = make_device_options(slot)
 		if not options: continue
 
@@ -535,16 +668,16 @@ def make_ram(machine):
 
 	options = [
 		{
-			"intValue": int(x.text),
-			"description": x.get("name"),
-			"value": x.get("name"),
-			"default": x.get("default") == "yes"
+			"intValue": x.value,
+			"description": x.name,
+			"value": x.name,
+			"default": x.default
 		}
-		for x in machine.findall('ramoption')
+		for x in machine.ramoptions
 	]
 
 	# special case for laser 3000....
-	if len(options) == 0 and machine.get('name') == 'las3000':
+	if len(options) == 0 and machine.name == 'las3000':
 		options.append( { "intValue": 192, "description": "192K", "value": "192K", "default": True} )
 
 	if not options: return None
@@ -567,10 +700,10 @@ def make_bios(m):
 
 	options = [
 		{
-			"value": x.get("name"),
-			"description": x.get("description")
+			"value": x.name,
+			"description": x.description
 		}
-		for x in m.findall('./biosset')
+		for x in m.biossets
 	]
 
 	if not options: return None
@@ -623,11 +756,10 @@ def make_smartport(machine):
 
 
 	for s in SLOTS:
-		path = 'slot[@name="{}"]'.format(s)
-		slot = machine.find(path)
+		slot = machine.slot(s)
 		if slot is None: continue
 
-		slotname = slot.get("name")
+		slotname = slot.name
 		options = make_device_options(slot)
 		if not options: continue
 		slots.append({
@@ -655,10 +787,10 @@ def make_slot(m, slotname, nodes):
 
 	has_default = False
 	for x in nodes:
-		name = x.get("name")
-		devname = x.get("devname")
-		desc = machine_cache[devname].find("description").text
-		default = x.get("default") == "yes"
+		name = x.name
+		devname = x.devname
+		desc = machine_cache[devname].description
+		default = x.default
 		disabled = name in DISABLED or (m, name) in DISABLED
 
 		if name in DEVICE_EXCLUDE: continue
@@ -687,30 +819,193 @@ def make_slot(m, slotname, nodes):
 	}
 
 
-def file_changed(path, data):
-	# check if a file has changed.
+def file_changed(path, tmp):
+	# check if a file has changed (compared to the newly written tmp file.)
 
 	try:
-		with open(path, mode='rb') as f:
-			d1 = hashlib.file_digest(f, 'sha256')
-	except Exception as e:
+		if filecmp.cmp(path, tmp, shallow=False): return False
+	except FileNotFoundError:
 		return 'new'
 
-	d2 = hashlib.sha256(bytes(data, 'utf8'))
-
-	if d1.digest() == d2.digest(): return False
 	return 'updated'
 
 
+#
+# build manifest.  For each machine plist, a fingerprint of everything it's
+# derived from: the mame build, the xml of every machine in its device subtree,
+# the slices of the lookup tables it uses, and the generator code itself.
+# if the fingerprint (and the file on disk) match, the machine is skipped
+# without deriving anything.
+#
+MANIFEST_PATH = "../Ample/Resources.manifest.json"
+
+def load_manifest():
+	try:
+		with open(MANIFEST_PATH) as f:
+			return json.load(f)
+	except FileNotFoundError:
+		return {}
+
+def save_manifest(manifest):
+	tmp = MANIFEST_PATH + ".tmp"
+	with open(tmp, "w") as f:
+		json.dump(manifest, f, indent="\t", sort_keys=True)
+		f.write("\n")
+	os.replace(tmp, MANIFEST_PATH)
+
+
+def _code_digest(h, code):
+	# bytecode, names and constants -- but not line numbers, so editing a
+	# table doesn't change the digest of the functions below it.
+	h.update(code.co_code)
+	h.update(repr(code.co_names).encode('utf8'))
+	for c in code.co_consts:
+		if isinstance(c, types.CodeType): _code_digest(h, c)
+		elif isinstance(c, frozenset): h.update(repr(sorted(c, key=repr)).encode('utf8'))
+		else: h.update(repr(c).encode('utf8'))
+
+_generator_digest = None
+
+def generator_digest():
+	global _generator_digest
+	if _generator_digest: return _generator_digest
+
+	# model.py shapes what everything is derived from, so its classes (the
+	# slots kept and the methods) count too.
+	h = hashlib.sha256()
+	for module in (globals(), vars(plist), vars(model)):
+		for k, v in sorted(module.items()):
+			if getattr(v, '__module__', None) != module['__name__']: continue
+			if isinstance(v, types.FunctionType):
+				v = getattr(v, '__wrapped__', v)
+				h.update(k.encode('utf8'))
+				_code_digest(h, v.__code__)
+			elif isinstance(v, type):
+				h.update(k.encode('utf8'))
+				h.update(repr(getattr(v, '__slots__', None)).encode('utf8'))
+				for name, f in sorted(vars(v).items()):
+					if isinstance(f, types.FunctionType):
+						h.update(name.encode('utf8'))
+						_code_digest(h, f.__code__)
+	_generator_digest = h.hexdigest()
+	return _generator_digest
+
+
+def mame_identity():
+	if db: return db.version
+	return mame.identity()
+
+
+_xml_digest = {}
+
+def xml_digest(name):
+	if name not in _xml_digest:
+		m = machine_cache.get(name)
+		_xml_digest[name] = m.digest() if m is not None else hashlib.sha256(b'').hexdigest()
+	return _xml_digest[name]
+
+
+def machine_tables(m, machine):
+	# the parts of the lookup tables this machine can see.
+	options = set()
+	for name in subtree:
+		x = machine_cache.get(name)
+		if x is None: continue
+		for o in x.slot_options(): options.add(o.name)
+
+	slots = set(x.name for x in machine.slots)
+
+	# drive options, as the tail of a <device> tag.
+	tags = set()
+	for name in subtree:
+		x = machine_cache.get(name)
+		if x is None: continue
+		for d in x.devices: tags.add((d.tag or "").split(":")[-1])
+
+	return [
+		[x for x in SLOTS if x in slots],
+		{ k: v for k, v in SLOT_NAMES.items() if k in slots or k in ('ramsize', 'bios') },
+		sorted(repr(x) for x in DISABLED if x in options or (type(x) == tuple and x[0] == m)),
+		{ k: v for k, v in DEVICE_REMAP.items() if k in options },
+		{ k: v for k, v in DEVICE_MEDIA.items() if k in options or k in tags },
+		sorted(x for x in DEVICE_EXCLUDE if x in options),
+		MEDIA_INTERFACES,
+		MEDIA_TYPES,
+	]
+
+
+def machine_fingerprint(m, machine):
+	h = hashlib.sha256()
+	h.update(mame_identity().encode('utf8'))
+	h.update(generator_digest().encode('utf8'))
+	for name in sorted(subtree):
+		h.update(name.encode('utf8'))
+		h.update(xml_digest(name).encode('utf8'))
+	h.update(json.dumps(machine_tables(m, machine), sort_keys=True).encode('utf8'))
+	return h.hexdigest()
+
+
+def output_unchanged(path, entry):
+	# stat first; only re-hash if the file was touched.
+	try:
+		st = os.stat(path)
+	except FileNotFoundError:
+		return False
+	if st.st_size != entry.get('size'): return False
+	if st.st_mtime_ns == entry.get('mtime'): return True
+	with open(path, mode='rb') as f:
+		return hashlib.file_digest(f, 'sha256').hexdigest() == entry.get('sha256')
+
+
+# output options recorded in the manifest; changing one rebuilds everything.
+LAYOUT = { 'format': 'xml', 'catalog': False, 'prune': True }
+
+def manifest_entry(path, inputs, layout, data):
+	st = os.stat(path)
+	with open(path, mode='rb') as f:
+		digest = hashlib.file_digest(f, 'sha256').hexdigest()
+	rv = { 'inputs': inputs, **layout, 'sha256': digest, 'size': st.st_size, 'mtime': st.st_mtime_ns, 'extensions': data.get("extensions") or {} }
+	# --catalog: the entries the plist refers to, checked before skipping it.
+	if layout['catalog']: rv['catalog_keys'] = [d["catalog"] for d in data["devices"] if "catalog" in d]
+	return rv
+
+
+#
+# extension -> media types, over every machine in the manifest (each
+# entry keeps its machine's extensions, so machines that were skipped
+# still count.)  Written after each run, like the machine plists, only
+# if it changed.
+#
+EXTENSIONS_PATH = "../Ample/Resources/extensions.plist"
+
+def write_extension_index(entries, format='xml'):
+	index = {}
+	for m in sorted(set(MACHINES) | set(MACHINES_EXTRA)):
+		x = entries.get(m)
+		if not x: continue
+		for media, extensions in x.get('extensions', {}).items():
+			for e in extensions: index.setdefault(e, set()).add(media)
+
+	data = { k: sorted(v) for k, v in sorted(index.items()) }
+	tmp = EXTENSIONS_PATH + ".tmp"
+	write_plist(data, tmp, format)
+	st = file_changed(EXTENSIONS_PATH, tmp)
+	if st == False:
+		os.remove(tmp)
+		return
+	print("extensions:", st)
+	os.replace(tmp, EXTENSIONS_PATH)
+
+
 def find_machine_resolution(machine):
 
-	name = machine.get("cloneof")
-	if not name: name = machine.get("name")
+	name = machine.cloneof
+	if not name: name = machine.name
 
 	# node = machine.find('display[@tag="screen"]')
-	node = machine.find('./display')
-	width = int(node.get("width"))
-	height = int(node.get("height"))
+	node = machine.displays[0]
+	width = node.width
+	height = node.height
 
 	hscale = 1
 	wscale = 1
@@ -759,28 +1054,7 @@ def find_machine_resolution(machine):
 
 
 
-devices = {}
-
-p = argparse.ArgumentParser()
-p.add_argument('machine', nargs="*")
-p.add_argument('--extra', action='store_true', help='also generate Ample Lite machines')
-args = p.parse_args()
-
-extra = args.extra
-machines = args.machine
-if not machines:
-	if extra:
-		machines = MACHINES_EXTRA
-	else:
-		machines = MACHINES
-
-for m in machines:
-
-	print(m)
-
-	machine = load_machine_recursive(m)
-	if machine is None:
-		exit(1)
+def make_machine(m, machine):
 
 	data = {  }
 
@@ -789,7 +1063,7 @@ for m in machines:
 	# machine = root.find(path)
 
 	data["value"] = m
-	data["description"] = machine.find("description").text
+	data["description"] = machine.description
 
 	data["media"] = find_machine_media(machine)
 
@@ -823,8 +1097,7 @@ for m in machines:
 		})
 
 	for s in SLOTS:
-		path = 'slot[@name="{}"]/slotoption'.format(s)
-		nodes = machine.findall(path)
+		nodes = machine.slot_options(s)
 		if not nodes: continue
 
 		s = make_slot(m, s, nodes)
@@ -836,15 +1109,382 @@ for m in machines:
 	if smartport: devices.insert(0, smartport)
 	data["devices"] = devices
 	data["software"] = find_software(machine)
+	x = find_extensions()
+	if x: data["extensions"] = x
+	add_defaults(data)
+
+	return data
+
+
+#
+# precomputed default configuration, so clients don't have to walk the
+# slot/option/devname graph on every selection: the default slot assignment
+# (slot name -> value, flat, as the apps keep it), the media it gives, and
+# for each option, what selecting it brings along -- its media and the
+# defaults of the slots under it.  Changing a slot whose subtree is at its
+# defaults is then: total - old option + new option, unless a slot involved
+# can appear more than once at the same time (the flat assignment shares
+# it; those are listed in shared_slots.)  The walks mirror AmpleWin's
+# initialize_default_slots and get_total_media.
+#
+def slot_defs(data):
+	# name -> device (or root slot), as the apps resolve a devname.
+	rv = {}
+	for x in (*data["devices"], *data["slots"]):
+		rv.setdefault(x.get("name"), x)
+	return rv
+
+def selected_option(slot, assigned):
+	v = str(assigned.get(slot.get("name")))
+	for o in slot.get("options", []):
+		if str(o.get("value")) == v: return o
+	return None
+
+def resolve_defaults(defs, node, assigned, depth=0):
+	if depth > 20: return
+	for s in node.get("slots", []):
+		name = s.get("name")
+		if not name: continue
+		if not assigned.get(name):
+			for o in s.get("options", []):
+				if o.get("default"):
+					if o.get("value") is not None: assigned[name] = o.get("value")
+					break
+		o = selected_option(s, assigned)
+		if o:
+			resolve_defaults(defs, o, assigned, depth + 1)
+			d = defs.get(o.get("devname"))
+			if d: resolve_defaults(defs, d, assigned, depth + 1)
+	if depth > 0:
+		for d in node.get("devices", []): resolve_defaults(defs, d, assigned, depth + 1)
+
+def count_media(defs, node, assigned, total, depth=0):
+	if depth > 15: return
+	for k, v in node.get("media", {}).items():
+		total[k] = total.get(k, 0) + v
+	for s in node.get("slots", []):
+		o = selected_option(s, assigned)
+		if o:
+			count_media(defs, o, assigned, total, depth + 1)
+			d = defs.get(o.get("devname"))
+			if d: count_media(defs, d, assigned, total, depth + 1)
+	if depth > 0:
+		for d in node.get("devices", []): count_media(defs, d, assigned, total, depth + 1)
+
+def slot_instances(defs, node, memo, depth=0):
+	# slot name -> how many can be present at once under node (capped at
+	# 2): slots add up, a slot's options are alternatives.
+	if depth > 20: return {}
+	rv = memo.get(id(node))
+	if rv is not None: return rv
+
+	rv = {}
+	def add(x):
+		for k, v in x.items(): rv[k] = min(2, rv.get(k, 0) + v)
+
+	for s in node.get("slots", []):
+		name = s.get("name")
+		if not name: continue
+		best = { name: 1 }
+		for o in s.get("options", []):
+			x = dict(slot_instances(defs, o, memo, depth + 1))
+			d = defs.get(o.get("devname"))
+			if d:
+				for k, v in slot_instances(defs, d, memo, depth + 1).items(): x[k] = min(2, x.get(k, 0) + v)
+			for k, v in x.items():
+				if k == name: v = min(2, v + 1)
+				best[k] = max(best.get(k, 0), v)
+		add(best)
+	if depth > 0:
+		for d in node.get("devices", []): add(slot_instances(defs, d, memo, depth + 1))
+	memo[id(node)] = rv
+	return rv
+
+def option_delta(defs, o, depth):
+	# (media, sub-slot defaults) of selecting option o, with its subtree at defaults.
+	d = defs.get(o.get("devname"))
+	assigned = {}
+	for _ in range(2): # the apps run this again on refresh; the 2nd pass can fill more.
+		resolve_defaults(defs, o, assigned, depth)
+		if d: resolve_defaults(defs, d, assigned, depth)
+	media = {}
+	count_media(defs, o, assigned, media, depth)
+	if d: count_media(defs, d, assigned, media, depth)
+	return media, assigned
+
+def add_defaults(data):
+	defs = slot_defs(data)
+
+	assigned = {}
+	for _ in range(2):
+		resolve_defaults(defs, data, assigned)
+	media = {}
+	count_media(defs, data, assigned, media)
+	data["defaults"] = assigned
+	data["default_media"] = { k: v for k, v in media.items() if v }
+
+	# every slot a client can show (the first one with a given name wins,
+	# as in the flat assignment.)
+	deltas = {}
+	seen = set()
+	todo = [(data, 0)]
+	while todo:
+		node, depth = todo.pop(0)
+		if depth > 20 or id(node) in seen: continue
+		seen.add(id(node))
+		for s in node.get("slots", []):
+			name = s.get("name")
+			if not name: continue
+			for o in s.get("options", []):
+				todo.append((o, depth + 1))
+				d = defs.get(o.get("devname"))
+				if d: todo.append((d, depth + 1))
+			if name in deltas: continue
+			x = {}
+			for o in s.get("options", []):
+				m, sub = option_delta(defs, o, depth + 1)
+				m = { k: v for k, v in m.items() if v }
+				if m or sub:
+					x[str(o.get("value"))] = { "media": m, "defaults": sub }
+			deltas[name] = x
+		if depth > 0:
+			for d in node.get("devices", []): todo.append((d, depth + 1))
+	data["option_deltas"] = { k: v for k, v in deltas.items() if v }
+	data["shared_slots"] = sorted(k for k, v in slot_instances(defs, data, {}).items() if v > 1)
+
+
+#
+# the apps only look a device up by the devname of an option they show,
+# so a device is kept only if it's reachable from the machine's own slots
+# through enabled options (disabled options have no devname; excluded ones
+# aren't emitted at all) -- and then from that device's options, and so on.
+#
+def prune_devices(data):
+	# returns the devices removed.
+
+	devices = { d["name"]: d for d in data["devices"] }
+	reached = set()
+	pending = [data]
+	while pending:
+		x = pending.pop()
+		for slot in x.get("slots", ()):
+			for o in slot.get("options", ()):
+				devname = o.get("devname")
+				if devname in devices and devname not in reached:
+					reached.add(devname)
+					pending.append(devices[devname])
+
+	removed = [d for d in data["devices"] if d["name"] not in reached]
+	if removed: data["devices"] = [d for d in data["devices"] if d["name"] in reached]
+	return removed
+
+def xml_size(x, depth):
+	# size of x as xml, nested depth levels deep in a plist.
+	t = plist.to_plist(x).encode('utf8')
+	t = t[len(plist._header):-len(plist._trailer)]
+	return len(t) + t.count(b'\n') * (depth - 1) * len(plist.INDENT)
+
+
+def resource_path(m):
+	return "../Ample/Resources/{}.plist".format(m)
 
 
-	path = "../Ample/Resources/{}.plist".format(m)
-	pl = to_plist(data)
-	st = file_changed(path, pl)
-	if st == False: continue
+def process_machine(m, entry):
+	# returns (fingerprint, plist data), data None if the manifest
+	# entry is still current.
+
+	with timing.stage("load", m):
+		machine = load_machine_recursive(m)
+	if machine is None:
+		return None, None
+
+	with timing.stage("fingerprint", m):
+		inputs = machine_fingerprint(m, machine)
+		if entry and entry.get('inputs') == inputs and output_unchanged(resource_path(m), entry):
+			return inputs, None
+
+	with timing.stage("derive", m):
+		return inputs, make_machine(m, machine)
+
+
+#
+# --catalog: device slot trees go into a shared, content-addressed catalog
+# (catalog/<key>.plist, key is a hash of the tree) and the machine's devices
+# list only has { name, catalog: key }.  The Disk II, scsi and serial cards
+# are then stored once instead of in every machine that has them.
+# Entries are only rewritten if missing or in the other --format (same
+# key, same content); stale ones are harmless and can be removed by deleting
+# the directory and rebuilding -- a machine whose manifest entry refers to
+# a missing entry isn't skipped.
+#
+CATALOG_DIR = "../Ample/Resources/catalog"
+
+catalog_written = set() # keys known to be on disk in this run's format
+
+def catalog_key(slots):
+	x = json.dumps(slots, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+	return hashlib.sha256(x.encode('utf8')).hexdigest()[:20]
+
+def catalog_current(key, format='xml'):
+	if key in catalog_written: return True
+	try:
+		with open(os.path.join(CATALOG_DIR, key + ".plist"), "rb") as f:
+			binary = f.read(8) == b'bplist00'
+	except FileNotFoundError:
+		return False
+	if binary != (format == 'binary'): return False
+	catalog_written.add(key)
+	return True
+
+def catalog_devices(data, format='xml'):
+
+	devices = []
+	for d in data["devices"]:
+		key = catalog_key(d["slots"])
+		if not catalog_current(key, format):
+			path = os.path.join(CATALOG_DIR, key + ".plist")
+			write_plist({ "slots": d["slots"] }, path + ".tmp", format)
+			os.replace(path + ".tmp", path)
+			catalog_written.add(key)
+		devices.append({ "name": d["name"], "catalog": key })
+	data["devices"] = devices
+
+
+def write_machine(m, data, format='xml'):
+	# streamed to a temp file, which replaces the original only if different.
+
+	path = resource_path(m)
+	tmp = path + ".tmp"
+	with timing.stage("encode", m):
+		write_plist(data, tmp, format)
+
+	with timing.stage("compare", m):
+		st = file_changed(path, tmp)
+	if st == False:
+		os.remove(tmp)
+		return
 	print(m + ':', st)
-	with open(path, "w") as f:
-		f.write(pl)
+	os.replace(tmp, path)
 
 
+#
+# --jobs: machines are spread over a process pool.  Each worker has its
+# own machine_cache (or its own connection to the read-only --db) and
+# returns the plist data; the parent writes them in order so the output
+# is identical to a serial run.
+#
+worker = False
+
+def init_worker(dbpath, mame_options, profile, profile_dir):
+	global db, worker
+	db = mamedb.open_db(dbpath) if dbpath else None
+	mame.set_options(mame_options)
+	timing.enabled = profile
+	timing.profile_dir = profile_dir
+	worker = True
+
+def run_worker(job):
+	# also returns the media cache (hits, misses) for this machine, and the
+	# --profile timings if it ran in a worker.
+	m, entry = job
+	hits, misses = media_stats['hits'], media_stats['misses']
+	rv = process_machine(m, entry)
+	t = timing.snapshot() if worker and timing.enabled else None
+	return (m, *rv, (media_stats['hits'] - hits, media_stats['misses'] - misses, t))
+
+
+def main(argv=None):
+	global db
+
+	p = argparse.ArgumentParser(fromfile_prefix_chars='@')
+	p.add_argument('machine', nargs="*")
+	p.add_argument('--extra', action='store_true', help='also generate Ample Lite machines')
+	p.add_argument('--db', help='use a mamedb database instead of running mame')
+	p.add_argument('-j', '--jobs', type=int, default=1, help='worker processes (0 = one per cpu)')
+	p.add_argument('--force', action='store_true', help='ignore the build manifest and rebuild everything')
+	p.add_argument('--format', choices=FORMATS, default='xml', help='plist format (default xml)')
+	p.add_argument('--catalog', action='store_true', help='store device slot trees in the shared device catalog')
+	p.add_argument('--no-prune', dest='prune', action='store_false', help='keep devices that can\'t be reached from the ui')
+	mame.add_arguments(p)
+	timing.add_arguments(p)
+	args = p.parse_args(argv)
+	mame.configure(args)
+	timing.configure(args)
+
+	extra = args.extra
+	machines = args.machine
+	if not machines:
+		if extra:
+			machines = MACHINES_EXTRA
+		else:
+			machines = MACHINES
+
+	manifest = load_manifest()
+	entries = manifest.setdefault('machines', {})
+	layout = { 'format': args.format, 'catalog': args.catalog, 'prune': args.prune }
+	def entry(m):
+		x = entries.get(m)
+		if args.force or not x: return None
+		if any(x.get(k, v) != layout[k] for k, v in LAYOUT.items()): return None
+		if args.catalog:
+			keys = x.get('catalog_keys')
+			if keys is None or not all(catalog_current(k, args.format) for k in keys): return None
+		return x
+	jobs = [(m, entry(m)) for m in machines]
+
+	if args.catalog: os.makedirs(CATALOG_DIR, exist_ok=True)
+
+	if args.jobs != 1:
+		# small chunks of neighbouring machines share most of their devices.
+		ex = ProcessPoolExecutor(args.jobs or os.cpu_count(), initializer=init_worker, initargs=(args.db, mame.options(), timing.enabled, timing.profile_dir))
+		results = ex.map(run_worker, jobs, chunksize=4)
+	else:
+		ex = None
+		if args.db: db = mamedb.open_db(args.db)
+		results = (run_worker(x) for x in jobs)
 
+	skipped = 0
+	hits = misses = 0
+	pruned = saved = 0
+	try:
+		for m, inputs, data, stats in results:
+			print(m)
+			hits += stats[0]
+			misses += stats[1]
+			if stats[2]: timing.merge(stats[2])
+			if inputs is None: exit(1)
+			if data is None:
+				skipped += 1
+				continue
+			if args.prune:
+				with timing.stage("prune", m):
+					removed = prune_devices(data)
+					if removed:
+						# devices array is 3 levels down (plist dict, devices array.)
+						n = sum(xml_size(d, 3) for d in removed)
+						print("    pruned {} devices, {} bytes".format(len(removed), n))
+						pruned += len(removed)
+						saved += n
+			if args.catalog:
+				with timing.stage("catalog", m):
+					catalog_devices(data, args.format)
+			write_machine(m, data, args.format)
+			with timing.stage("manifest", m):
+				entries[m] = manifest_entry(resource_path(m), inputs, layout, data)
+	finally:
+		if ex: ex.shutdown(cancel_futures=True)
+		save_manifest(manifest)
+		# build_resources --watch calls main() again in this process.
+		if db:
+			db.close()
+			db = None
+
+	write_extension_index(entries, args.format)
+
+	if skipped: print("{} unchanged".format(skipped))
+	if hits or misses: print("media cache: {} hits, {} misses".format(hits, misses))
+	if pruned: print("pruned {} devices, {} bytes".format(pruned, saved))
+
+
+if __name__ == '__main__':
+	main()
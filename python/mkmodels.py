@@ -4,9 +4,11 @@ import re
 import sys
 import argparse
 
-from plist import to_plist
+from plist import write_plist, FORMATS
 from machines import MACHINES, MACHINES_EXTRA
 import mame
+import mamedb
+import timing
 
 
 apple1_children = None
@@ -150,7 +152,13 @@ tree = TREE
 p = argparse.ArgumentParser()
 p.add_argument('--extra', action='store_true')
 p.add_argument('machine', nargs="*")
+p.add_argument('--format', choices=FORMATS, default='xml', help='plist format (default xml)')
+p.add_argument('--db', help='use a mamedb database instead of running mame')
+mame.add_arguments(p)
+timing.add_arguments(p)
 args = p.parse_args()
+mame.configure(args)
+timing.configure(args)
 
 extra = args.extra
 
@@ -167,21 +175,29 @@ names = {}
 
 #t = st.stdout
 
-t = mame.run("-listfull", *machines)
+if args.db:
+	with timing.stage("db"):
+		db = mamedb.open_db(args.db)
+		for name in machines:
+			m = db.machine(name)
+			if m is not None: names[name] = m.findtext("description")
+		db.close()
+else:
+	t = mame.run("-listfull", *machines)
 
-lines = t.split("\n")
-lines.pop(0)
-for x in lines:
-	x = x.strip()
-	if x == "": continue
-	m = re.fullmatch(r"^([A-Za-z0-9_]+)\s+\"([^\"]+)\"$", x)
-	if not m:
-		print("hmmm....", x)
-		continue
-	name = m[1]
-	desc = m[2]
+	lines = t.split("\n")
+	lines.pop(0)
+	for x in lines:
+		x = x.strip()
+		if x == "": continue
+		m = re.fullmatch(r"^([A-Za-z0-9_]+)\s+\"([^\"]+)\"$", x)
+		if not m:
+			print("hmmm....", x)
+			continue
+		name = m[1]
+		desc = m[2]
 
-	names[name] = desc
+		names[name] = desc
 
 
 def make_children(clist):
@@ -206,6 +222,6 @@ if extra:
 	path = "../Ample/Resources/models~extra.plist"
 else:
 	path = "../Ample/Resources/models.plist"
-with open(path, "w") as f:
-	f.write(to_plist(data))
+with timing.stage("write"):
+	write_plist(data, path, args.format)
 
@@ -8,7 +8,9 @@ from os.path import splitext
 
 from machines import MACHINES, MACHINES_EXTRA
 import mame
-from plist import to_plist
+import mamedb
+import timing
+from plist import write_plist, FORMATS
 
 #
 # merged algo -- rom are included, device_ref's are NOT.
@@ -36,6 +38,20 @@ def machine_has_roms(m):
 	# if m.find('./biosset') != None: return true
 	# return False
 
+def machine_roms(m):
+	# the dumped roms stored in m's own set (ones with a merge attribute
+	# come from the parent.)
+	rv = []
+	for x in m.findall('./rom'):
+		if x.get("status") == "nodump": continue
+		if x.get("merge"): continue
+		f = { 'name': x.get("name"), 'size': int(x.get("size", 0)) }
+		for k in ("crc", "sha1", "status"):
+			v = x.get(k)
+			if v: f[k] = v
+		rv.append(f)
+	return rv
+
 def machine_description(m):
 	desc = m.find("description").text
 	return desc
@@ -53,8 +69,11 @@ def fix_machine_description(x, devname):
 
 
 romdata = {  }
+romfiles = {} # set -> [rom, ...]
+romdeps = {} # machine/device -> (romof, cloneof, has roms, [device, ...]) (--closure)
 parents = set()
 processed = set()
+db = None # mamedb, if --db
 
 def process_machine(mname):
 
@@ -67,14 +86,16 @@ def process_machine(mname):
 
 
 
-	xml = mame.run(mname, "-listxml")
-	root = ET.fromstring(xml)
+	if db:
+		machines = db.listxml(mname, exclude=processed)
+	else:
+		machines = mame.listxml(mname)
 
 	# todo -- if child in included and has roms, mark them with the parent.
 
 	# first = True
 	# included = set()
-	for m in root.findall('./machine'):
+	for m in machines:
 
 		nm = m.get('name')
 		if nm in EXCLUDE: continue
@@ -85,12 +106,25 @@ def process_machine(mname):
 
 		if parent: parents.add(parent)
 
-		needs_roms = parent == None and machine_has_roms(m)
+		# a set of its own: no parent at all, or a romof (bios) parent that
+		# isn't its cloneof and roms that don't all come from it.
+		needs_roms = machine_has_roms(m) and (parent == None or (m.get('cloneof') == None and machine_roms(m)))
 
 		if needs_roms:
 			romdata[nm] = machine_description(m)
 			#included.add(nm)
 
+		if args.closure:
+			# device_refs, plus default slot cards (and, through them,
+			# their own defaults.)
+			deps = [x.get('name') for x in m.findall('./device_ref')]
+			deps.extend(x.get('devname') for x in m.findall('./slot/slotoption[@default="yes"]'))
+			romdeps[nm] = (parent, m.get('cloneof'), machine_has_roms(m), deps)
+
+		# merged sets -- a clone's own roms live in the parent's zip.
+		files = machine_roms(m)
+		if files: romfiles.setdefault(m.get('cloneof') or nm, []).extend(files)
+
 		# if first:
 		# 	first = False
 
@@ -103,11 +137,21 @@ def process_machine(mname):
 
 
 
-p = argparse.ArgumentParser()
+p = argparse.ArgumentParser(fromfile_prefix_chars='@')
 p.add_argument('--full', action='store_true')
 p.add_argument('--extra', action='store_true')
+p.add_argument('--db', help='use a mamedb database instead of running mame')
 p.add_argument('machine', nargs="*")
+p.add_argument('--format', choices=FORMATS, default='xml', help='plist format (default xml)')
+p.add_argument('--hashes', action='store_true', help='also write the rom hash manifest (romhashes.plist)')
+p.add_argument('--closure', action='store_true', help='also write the rom sets each machine needs (romdeps.plist)')
+mame.add_arguments(p)
+timing.add_arguments(p)
 args = p.parse_args()
+mame.configure(args)
+timing.configure(args)
+
+if args.db: db = mamedb.open_db(args.db)
 
 extra = args.extra
 machines = args.machine
@@ -118,18 +162,39 @@ if not machines:
 		machines = [ *MACHINES, *EXTRA_MACHINES]
 
 
+# fetch every machine's -listxml concurrently up front (into the result
+# cache); process_machine then reads them in order.
+if not db:
+	with timing.stage("prefetch"):
+		mame.prefetch([(m, "-listxml") for m in machines])
 
 for mname in machines:
-	process_machine(mname)
+	with timing.stage("process", mname):
+		process_machine(mname)
 
 
 missing = parents - processed
 if len(missing):
 	print('Missing parents:')
-	for x in missing: process_machine(x)
-
-
-ROMS =  [{ 'value': k, 'description': fix_machine_description(v, k)} for k, v in romdata.items()];
+	for x in missing:
+		with timing.stage("process", x):
+			process_machine(x)
+
+
+def set_files(k):
+	# the files in set k's (merged) zip.
+	files = {}
+	for f in romfiles.get(k, []):
+		files.setdefault(f['name'], f) # parent first, then clones
+	return sorted(files.values(), key=lambda x: x['name'])
+
+# size (uncompressed bytes) and files let the downloaders show progress and
+# schedule small sets first.
+ROMS = []
+for k, v in romdata.items():
+	files = set_files(k)
+	ROMS.append({ 'value': k, 'description': fix_machine_description(v, k),
+		'size': sum(x['size'] for x in files), 'files': len(files) })
 ROMS.sort(key=lambda x: x.get('description'))
 # print(ROMS)
 
@@ -138,5 +203,68 @@ if extra:
 else:
 	path = "../Ample/Resources/roms.plist"
 
-with open(path, "w") as f:
-	f.write(to_plist(ROMS))
+with timing.stage("write"):
+	write_plist(ROMS, path, args.format)
+
+
+#
+# rom hash manifest: for each set in roms.plist, its files (name, size, crc,
+# sha1, and status if it's a bad dump) and total size, plus a sha1 index
+# (sha1 -> [ "set/file", ... ]) for duplicate detection.  Enough to verify a
+# merged zip without running mame.
+#
+def make_manifest():
+	sets = {}
+	index = {}
+	for k in sorted(romdata):
+		files = set_files(k)
+		sets[k] = { 'size': sum(x['size'] for x in files), 'files': files }
+		for f in files:
+			if 'sha1' in f: index.setdefault(f['sha1'], []).append(k + "/" + f['name'])
+	return { 'sets': sets, 'sha1': index }
+
+#
+# rom closure: for each machine, the (merged) rom sets it needs to start --
+# its own, its romof chain (parent, bios) and those of every device it
+# references, including default slot cards.  Only sets roms.plist lists
+# (anything else is entirely in the romof chain.)
+#
+def rom_closure(name):
+	rv = set()
+	seen = set()
+	todo = [name]
+	while todo:
+		nm = todo.pop()
+		if nm in seen or nm not in romdeps: continue
+		seen.add(nm)
+		romof, cloneof, has_roms, deps = romdeps[nm]
+		x = cloneof or nm
+		if has_roms and x in romdata: rv.add(x)
+		if romof: todo.append(romof)
+		todo.extend(deps)
+	return sorted(rv)
+
+if args.closure:
+	if extra:
+		path = "../Ample/Resources/romdeps~extra.plist"
+	else:
+		path = "../Ample/Resources/romdeps.plist"
+
+	with timing.stage("closure"):
+		data = { m: rom_closure(m) for m in sorted(machines) }
+		write_plist(data, path, args.format)
+	print("{} machines, {:.1f} rom sets each".format(len(data), sum(len(x) for x in data.values()) / max(1, len(data))))
+
+
+if args.hashes:
+	if extra:
+		path = "../Ample/Resources/romhashes~extra.plist"
+	else:
+		path = "../Ample/Resources/romhashes.plist"
+
+	with timing.stage("hashes"):
+		data = make_manifest()
+		write_plist(data, path, args.format)
+	print("{} sets, {} files, {} bytes".format(len(data['sets']),
+		sum(len(x['files']) for x in data['sets'].values()),
+		sum(x['size'] for x in data['sets'].values())))
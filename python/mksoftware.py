@@ -0,0 +1,102 @@
+import argparse
+import os
+import plistlib
+
+import xml.etree.ElementTree as ET
+
+from machines import MACHINES, MACHINES_EXTRA
+from plist import write_plist, FORMATS
+import mame
+import timing
+
+#
+# precompiled software list index: every list referenced by a machine
+# plist's "software" entries, compiled from mame's hash/<list>.xml into
+# software/<list>.plist --
+#
+# { name, description, items: [ { name, description, compatibility, parts: [ { name, interface } ] } ] }
+#
+# items are sorted by description (case-insensitive) and compatibility is
+# omitted when the software doesn't declare one.  Run after mkmachines.py.
+#
+
+SOFTWARE_DIR = "../Ample/Resources/software"
+
+
+def machine_lists(m):
+	# list names (without .xml) from a machine plist.
+	path = "../Ample/Resources/{}.plist".format(m)
+	if not os.path.exists(path): return []
+	with open(path, "rb") as f:
+		data = plistlib.load(f)
+
+	rv = []
+	for x in data.get("software", []):
+		if isinstance(x, dict): x = x.get("name")
+		if x: rv.append(x.removesuffix(".xml"))
+	return rv
+
+
+def compile_list(path):
+	# streamed -- some lists have thousands of entries.
+	name = os.path.splitext(os.path.basename(path))[0]
+	rv = { "name": name, "description": name }
+	items = []
+	for event, x in ET.iterparse(path, events=('start', 'end')):
+		if event == 'start':
+			if x.tag == 'softwarelist': rv["description"] = x.get("description", name)
+			continue
+		if x.tag != 'software': continue
+
+		sw = { "name": x.get("name"), "description": x.findtext("description") or x.get("name") }
+		for y in x.findall("sharedfeat"):
+			if y.get("name") == "compatibility":
+				sw["compatibility"] = y.get("value")
+				break
+		sw["parts"] = [{ "name": y.get("name"), "interface": y.get("interface") } for y in x.findall("part")]
+		items.append(sw)
+		x.clear()
+
+	items.sort(key=lambda x: x["description"].lower())
+	rv["items"] = items
+	return rv
+
+
+p = argparse.ArgumentParser()
+p.add_argument('--hash', help='mame hash directory (default: hash next to the mame binary)')
+p.add_argument('--format', choices=FORMATS, default='xml', help='plist format (default xml)')
+p.add_argument('list', nargs="*", help='software lists to compile (default: every one the machine plists use)')
+mame.add_arguments(p)
+timing.add_arguments(p)
+args = p.parse_args()
+mame.configure(args)
+timing.configure(args)
+
+hashdir = args.hash or os.path.join(os.path.dirname(mame.path), "hash")
+
+lists = args.list
+if not lists:
+	lists = set()
+	for m in [*MACHINES, *MACHINES_EXTRA]:
+		lists.update(machine_lists(m))
+	lists = sorted(lists)
+
+os.makedirs(SOFTWARE_DIR, exist_ok=True)
+
+done = 0
+count = 0
+for x in lists:
+	path = os.path.join(hashdir, x + ".xml")
+	if not os.path.exists(path):
+		print("missing: {}".format(path))
+		continue
+
+	print(x)
+	with timing.stage("compile", x):
+		data = compile_list(path)
+	with timing.stage("write", x):
+		write_plist(data, os.path.join(SOFTWARE_DIR, x + ".plist"), args.format)
+	done += 1
+	count += len(data["items"])
+
+print("{} lists, {} items".format(done, count))
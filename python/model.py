@@ -0,0 +1,163 @@
+
+#
+# compact in-memory form of a -listxml <machine>, keeping only what
+# mkmachines reads.  Strings are interned since device names, tags and
+# descriptions repeat across thousands of machines.
+#
+# device_ref is just a name, so device_refs is a tuple of interned names
+# (duplicates kept -- a machine with two floppy_apple refs has two drives.)
+#
+
+import hashlib
+from sys import intern
+
+__all__ = ['Machine', 'Slot', 'SlotOption', 'Device', 'BiosSet', 'RamOption', 'Display', 'SoftwareList']
+
+
+def _intern(x):
+	if x is None: return None
+	return intern(x)
+
+def _int(x):
+	if x is None: return None
+	return int(x)
+
+
+class Display(object):
+	__slots__ = ('width', 'height')
+
+	def __init__(self, e):
+		self.width = _int(e.get('width'))
+		self.height = _int(e.get('height'))
+
+
+class Device(object):
+	# <device> -- media devices
+	__slots__ = ('type', 'tag', 'interface', 'extensions')
+
+	def __init__(self, e):
+		self.type = _intern(e.get('type'))
+		self.tag = _intern(e.get('tag'))
+		self.interface = _intern(e.get('interface'))
+		self.extensions = tuple(_intern(x.get('name')) for x in e.iterfind('extension'))
+
+
+class SlotOption(object):
+	__slots__ = ('name', 'devname', 'default')
+
+	def __init__(self, e):
+		self.name = _intern(e.get('name'))
+		self.devname = _intern(e.get('devname'))
+		self.default = e.get('default') == 'yes'
+
+
+class Slot(object):
+	__slots__ = ('name', 'options')
+
+	def __init__(self, e):
+		self.name = _intern(e.get('name'))
+		self.options = tuple(SlotOption(x) for x in e.iterfind('slotoption'))
+
+
+class BiosSet(object):
+	__slots__ = ('name', 'description')
+
+	def __init__(self, e):
+		self.name = _intern(e.get('name'))
+		self.description = _intern(e.get('description'))
+
+
+class RamOption(object):
+	__slots__ = ('name', 'value', 'default')
+
+	def __init__(self, e):
+		self.name = _intern(e.get('name'))
+		self.value = int(e.text)
+		self.default = e.get('default') == 'yes'
+
+
+class SoftwareList(object):
+	__slots__ = ('name', 'filter')
+
+	def __init__(self, e):
+		self.name = _intern(e.get('name'))
+		self.filter = _intern(e.get('filter'))
+
+
+class Machine(object):
+	__slots__ = ('name', 'sourcefile', 'cloneof', 'description',
+		'devices', 'slots', 'device_refs', 'biossets', 'ramoptions', 'displays', 'softwarelists',
+		'_index')
+
+	def __init__(self, e):
+		self.name = _intern(e.get('name'))
+		self.sourcefile = _intern(e.get('sourcefile'))
+		self.cloneof = _intern(e.get('cloneof'))
+		self.description = _intern(e.findtext('description'))
+
+		devices = []
+		slots = []
+		device_refs = []
+		biossets = []
+		ramoptions = []
+		displays = []
+		softwarelists = []
+		for x in e:
+			tag = x.tag
+			if tag == 'device': devices.append(Device(x))
+			elif tag == 'slot': slots.append(Slot(x))
+			elif tag == 'device_ref': device_refs.append(_intern(x.get('name')))
+			elif tag == 'biosset': biossets.append(BiosSet(x))
+			elif tag == 'ramoption': ramoptions.append(RamOption(x))
+			elif tag == 'display': displays.append(Display(x))
+			elif tag == 'softwarelist': softwarelists.append(SoftwareList(x))
+
+		self.devices = tuple(devices)
+		self.slots = tuple(slots)
+		self.device_refs = tuple(device_refs)
+		self.biossets = tuple(biossets)
+		self.ramoptions = tuple(ramoptions)
+		self.displays = tuple(displays)
+		self.softwarelists = tuple(softwarelists)
+		self._index = None
+
+	#
+	# lookup index, built on first use: slot name -> first slot, slot name
+	# (None for all) -> options, and the set of device_ref names.
+	#
+	def index(self):
+		if self._index is None:
+			slots = {}
+			options = { None: [] }
+			for x in self.slots:
+				slots.setdefault(x.name, x)
+				options.setdefault(x.name, []).extend(x.options)
+				options[None].extend(x.options)
+			self._index = (slots, { k: tuple(v) for k, v in options.items() }, frozenset(self.device_refs))
+		return self._index
+
+	def slot(self, name):
+		# first slot with this name, or None.
+		return self.index()[0].get(name)
+
+	def slot_options(self, name=None):
+		# every slot option (of the named slot(s))
+		return self.index()[1].get(name, ())
+
+	def has_device_ref(self, name):
+		return name in self.index()[2]
+
+	def digest(self):
+		# sha256 of everything kept, for the build manifest.
+		return hashlib.sha256(repr(_state(self)).encode('utf8')).hexdigest()
+
+
+def _state(x):
+	if type(x) is tuple: return tuple(_state(y) for y in x)
+	if hasattr(x, '__slots__'): return (type(x).__name__, *(_state(getattr(x, k)) for k in x.__slots__ if k[0] != '_'))
+	return x
+
+
+def from_element(e):
+	if e is None: return None
+	return Machine(e)
@@ -1,7 +1,9 @@
 
 
-__all__ = ['to_plist']
+__all__ = ['to_plist', 'dump_plist', 'to_bplist', 'dump_bplist', 'write_plist', 'FORMATS']
 
+import io
+import struct
 from xml.sax.saxutils import escape
 from base64 import b64encode
 from datetime import date, datetime, timezone
@@ -20,46 +22,9 @@ def _bad(x, akku, indent=""):
 
 
 
-def _encode_array(x, akku, indent=""):
-
-	indent2 = indent + INDENT
-	
-	akku.append(indent + "<array>\n")
-
-	for v in x:
-		_encoder.get(type(v), _bad)(v, akku, indent2)
-
-	akku.append(indent + "</array>\n")
-
-
-def _encode_dict(x, akku, indent=""):
-
-	indent2 = indent + INDENT
-
-	akku.append(indent + "<dict>\n")
-	for k,v in x.items():
-		# key must be string?
-		if type(k) != str:
-			raise ValueError("plist: dictionary key must be string: {}: {}".format(type(k), k))
-		akku.append("{}<key>{}</key>\n".format(indent2, escape(k)))
-		_encoder.get(type(v), _bad)(v, akku, indent2)
-
-	akku.append(indent + "</dict>\n")
-
-
-def _encode_bool(x, akku, indent=""):
-	if x: akku.append(indent + "<true/>\n")
-	else: akku.append(indent + "<false/>\n")
-
-def _encode_integer(x, akku, indent=""):
-	akku.append("{}<integer>{}</integer>\n".format(indent, x))
-
 def _encode_real(x, akku, indent=""):
 	akku.append("{}<real>{}</real>\n".format(indent, x))
 
-def _encode_string(x, akku, indent=""):
-	akku.append("{}<string>{}</string>\n".format(indent, escape(x)))
-
 
 # data is YYYY-MM-DD T HH:MM:SS Z
 def _encode_date(x, akku, indent=""):
@@ -100,14 +65,7 @@ def _encode_data(x, akku, indent=""):
 
 # data, data not yet supported.
 _encoder = {
-	str: _encode_string,
 	float: _encode_real,
-	int: _encode_integer,
-	bool: _encode_bool,
-
-	tuple: _encode_array,
-	list: _encode_array,
-	dict: _encode_dict,
 	bytes: _encode_data,
 	bytearray: _encode_data,
 	date: _encode_date,
@@ -116,11 +74,198 @@ _encoder = {
 
 def to_plist(x):
 
-	akku = []
-	akku.append(_header)
-	_encoder.get(type(x), _bad)(x, akku, INDENT)
+	akku = [_header]
+	_dump_value(x, akku, INDENT, None)
 	akku.append(_trailer)
-
 	return ''.join(akku)
 
 
+#
+# streaming writer.  dict/list/str/bool/int -- which is everything the
+# generators emit -- are handled inline, one line (or one key/value pair)
+# per fragment; anything else goes through the _encoder table above.
+# fragments are handed to fp in chunks as containers complete, so only a
+# bounded amount of text is held at once.
+#
+
+# flush once at least this many fragments are pending.
+CHUNK = 4096
+
+def _escape(x):
+	if '&' in x or '<' in x or '>' in x: return escape(x)
+	return x
+
+def _flush(akku, fp):
+	fp.write(''.join(akku))
+	akku.clear()
+
+def _dump_value(x, akku, indent, fp):
+	t = type(x)
+	if t is dict: _dump_dict(x, akku, indent, fp)
+	elif t is list or t is tuple: _dump_array(x, akku, indent, fp)
+	elif t is str: akku.append(indent + "<string>" + _escape(x) + "</string>\n")
+	elif t is bool: akku.append(indent + ("<true/>\n" if x else "<false/>\n"))
+	elif t is int: akku.append(indent + "<integer>" + str(x) + "</integer>\n")
+	else: _encoder.get(t, _bad)(x, akku, indent)
+
+def _dump_array(x, akku, indent, fp):
+
+	indent2 = indent + INDENT
+	a = akku.append
+	a(indent + "<array>\n")
+	for v in x:
+		t = type(v)
+		if t is dict: _dump_dict(v, akku, indent2, fp)
+		elif t is str: a(indent2 + "<string>" + _escape(v) + "</string>\n")
+		else: _dump_value(v, akku, indent2, fp)
+	a(indent + "</array>\n")
+
+def _dump_dict(x, akku, indent, fp):
+
+	indent2 = indent + INDENT
+	key = indent2 + "<key>"
+	string = "</key>\n" + indent2 + "<string>"
+	integer = "</key>\n" + indent2 + "<integer>"
+	true = "</key>\n" + indent2 + "<true/>\n"
+	false = "</key>\n" + indent2 + "<false/>\n"
+
+	a = akku.append
+	a(indent + "<dict>\n")
+	for k, v in x.items():
+		if type(k) is not str:
+			raise ValueError("plist: dictionary key must be string: {}: {}".format(type(k), k))
+		if '&' in k or '<' in k or '>' in k: k = escape(k)
+		t = type(v)
+		if t is str:
+			if '&' in v or '<' in v or '>' in v: v = escape(v)
+			a(key + k + string + v + "</string>\n")
+		elif t is bool: a(key + k + (true if v else false))
+		elif t is int: a(key + k + integer + str(v) + "</integer>\n")
+		else:
+			a(key + k + "</key>\n")
+			_dump_value(v, akku, indent2, fp)
+	a(indent + "</dict>\n")
+
+	if fp is not None and len(akku) >= CHUNK: _flush(akku, fp)
+
+
+def dump_plist(x, fp):
+	# fp is a text file.
+	akku = [_header]
+	_dump_value(x, akku, INDENT, fp)
+	akku.append(_trailer)
+	_flush(akku, fp)
+
+
+#
+# binary (bplist00) writer.  objects are numbered depth-first with the
+# root as object 0; equal scalars (strings, numbers, dates, data) are
+# stored once and shared by reference.  containers are never shared (even
+# if the same python object appears twice), so a reader that mutates what
+# it loaded sees the same structure as XML.
+#
+
+_BPLIST_EPOCH = datetime(2001, 1, 1, tzinfo=timezone.utc)
+
+def _bplist_len(tok, n):
+	if n < 15: return bytes((tok | n,))
+	return bytes((tok | 0x0f,)) + _bplist_int(n)
+
+def _bplist_int(x):
+	if x < 0: return struct.pack('>Bq', 0x13, x)
+	if x < 1 << 8: return struct.pack('>BB', 0x10, x)
+	if x < 1 << 16: return struct.pack('>BH', 0x11, x)
+	if x < 1 << 32: return struct.pack('>BL', 0x12, x)
+	if x < 1 << 63: return struct.pack('>Bq', 0x13, x)
+	if x < 1 << 64: return struct.pack('>BQQ', 0x14, 0, x)
+	raise OverflowError("plist: integer too large: {}".format(x))
+
+def _bplist_scalar(x):
+	t = type(x)
+	if t is str:
+		if x.isascii(): return _bplist_len(0x50, len(x)) + x.encode('ascii')
+		b = x.encode('utf-16be')
+		return _bplist_len(0x60, len(b) // 2) + b
+	if t is bool: return b'\x09' if x else b'\x08'
+	if t is int: return _bplist_int(x)
+	if t is float: return struct.pack('>Bd', 0x23, x)
+	if t is bytes or t is bytearray: return _bplist_len(0x40, len(x)) + bytes(x)
+	if t is datetime: return struct.pack('>Bd', 0x33, (x.astimezone(timezone.utc) - _BPLIST_EPOCH).total_seconds())
+	if t is date:
+		x = datetime(x.year, x.month, x.day, tzinfo=timezone.utc)
+		return struct.pack('>Bd', 0x33, (x - _BPLIST_EPOCH).total_seconds())
+	_bad(x, None)
+
+
+class _BPlistWriter(object):
+
+	def __init__(self):
+		self.objects = []   # unique scalars and (marker, refs) for containers, in object order
+		self.scalars = {}   # (type, value) -> object number
+
+	def flatten(self, x):
+		# returns the object number of x.
+		t = type(x)
+		if t is dict or t is list or t is tuple:
+			n = len(self.objects)
+			self.objects.append(None)
+			if t is dict:
+				for k in x:
+					if type(k) is not str:
+						raise ValueError("plist: dictionary key must be string: {}: {}".format(type(k), k))
+				refs = [self.flatten(k) for k in x]
+				refs.extend(self.flatten(v) for v in x.values())
+				self.objects[n] = (0xd0, len(x), refs)
+			else:
+				self.objects[n] = (0xa0, len(x), [self.flatten(v) for v in x])
+			return n
+
+		key = (t, x)
+		n = self.scalars.get(key)
+		if n is None:
+			n = self.scalars[key] = len(self.objects)
+			self.objects.append(x)
+		return n
+
+	def write(self, x, fp):
+		self.flatten(x)
+
+		n = len(self.objects)
+		ref_fmt = 'B' if n < 1 << 8 else 'H' if n < 1 << 16 else 'L'
+		ref_size = struct.calcsize(ref_fmt)
+
+		fp.write(b'bplist00')
+		offset = 8
+		offsets = []
+		for x in self.objects:
+			if type(x) is tuple:
+				tok, count, refs = x
+				b = _bplist_len(tok, count) + struct.pack('>{}{}'.format(len(refs), ref_fmt), *refs)
+			else:
+				b = _bplist_scalar(x)
+			offsets.append(offset)
+			fp.write(b)
+			offset += len(b)
+
+		offset_fmt = 'B' if offset < 1 << 8 else 'H' if offset < 1 << 16 else 'L' if offset < 1 << 32 else 'Q'
+		fp.write(struct.pack('>{}{}'.format(n, offset_fmt), *offsets))
+		fp.write(struct.pack('>6xBBQQQ', struct.calcsize(offset_fmt), ref_size, n, 0, offset))
+
+
+def to_bplist(x):
+	f = io.BytesIO()
+	dump_bplist(x, f)
+	return f.getvalue()
+
+def dump_bplist(x, fp):
+	# fp is a binary file.
+	_BPlistWriter().write(x, fp)
+
+
+FORMATS = ('xml', 'binary')
+
+def write_plist(x, path, format='xml'):
+	if format == 'binary':
+		with open(path, 'wb') as f: dump_bplist(x, f)
+	else:
+		with open(path, 'w') as f: dump_plist(x, f)
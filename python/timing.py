@@ -0,0 +1,187 @@
+
+#
+# --profile support for the generators.
+#
+# with timing.stage("derive", m): ...
+#
+# records wall and cpu time per stage (and per machine, if given), plus
+# counters (mame subprocesses, bytes of xml parsed.)  At exit, a json report
+# is written and the slowest stages and machines are printed.  Stages nest;
+# times are inclusive.  With --profile-dir, each stage also gets a cProfile
+# dump (<dir>/<script>-<stage>.prof), covering time not already inside an
+# outer profiled stage (and merged over mkmachines -j worker processes.)
+#
+
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+
+from contextlib import contextmanager
+
+
+enabled = False
+top = 20
+path = None
+profile_dir = None
+script = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+
+stages = {}   # name -> [wall, cpu, calls]
+machines = {} # machine -> { stage -> [wall, cpu] }, plus 'total' for outermost stages
+counters = {}
+_depth = 0
+_profiles = {} # stage -> cProfile.Profile
+_merged = {} # stage -> pstats.Stats, from worker processes
+_active = None # stage whose profiler is running
+_start = (time.perf_counter(), time.process_time())
+
+
+def add_arguments(p):
+	p.add_argument('--profile', nargs='?', const='', metavar='JSON', help='record stage timings (report: profile-<script>.json)')
+	p.add_argument('--profile-top', type=int, default=top, metavar='N', help='rows in the timing table (default {})'.format(top))
+	p.add_argument('--profile-dir', help='also write a cProfile dump per stage here')
+
+def configure(args):
+	global enabled, top, path, profile_dir
+	if args.profile is None: return
+	enabled = True
+	top = args.profile_top
+	path = args.profile or "profile-{}.json".format(script)
+	profile_dir = args.profile_dir
+	if profile_dir: os.makedirs(profile_dir, exist_ok=True)
+	atexit.register(report)
+
+
+def count(name, n=1):
+	if enabled: counters[name] = counters.get(name, 0) + n
+
+
+@contextmanager
+def stage(name, machine=None):
+	global _depth, _active
+	if not enabled:
+		yield
+		return
+
+	prof = None
+	if profile_dir and _active is None:
+		prof = _profiles.get(name)
+		if prof is None: prof = _profiles[name] = cProfile.Profile()
+		_active = name
+		prof.enable()
+
+	outer = _depth == 0
+	_depth += 1
+	wall, cpu = time.perf_counter(), time.process_time()
+	try:
+		yield
+	finally:
+		wall = time.perf_counter() - wall
+		cpu = time.process_time() - cpu
+		_depth -= 1
+		if prof:
+			prof.disable()
+			_active = None
+
+		x = stages.setdefault(name, [0.0, 0.0, 0])
+		x[0] += wall
+		x[1] += cpu
+		x[2] += 1
+		if machine is not None:
+			m = machines.setdefault(machine, {})
+			keys = (name, 'total') if outer else (name,)
+			for k in keys:
+				x = m.setdefault(k, [0.0, 0.0])
+				x[0] += wall
+				x[1] += cpu
+
+
+#
+# worker processes (mkmachines -j) send their numbers back to the parent.
+#
+class _Stats(object):
+	# raw cProfile stats, in the form pstats.Stats loads.
+	def __init__(self, stats):
+		self.stats = stats
+
+	def create_stats(self):
+		pass
+
+def _add_stats(name, x):
+	if not x.stats: return
+	if name in _merged: _merged[name].add(x)
+	else: _merged[name] = pstats.Stats(x)
+
+def snapshot():
+	# and reset.
+	profiles = {}
+	for k, prof in _profiles.items():
+		prof.create_stats()
+		profiles[k] = prof.stats
+	rv = { 'stages': dict(stages), 'machines': dict(machines), 'counters': dict(counters), 'profiles': profiles }
+	stages.clear()
+	machines.clear()
+	counters.clear()
+	_profiles.clear()
+	return rv
+
+def merge(x):
+	for k, v in x['stages'].items():
+		y = stages.setdefault(k, [0.0, 0.0, 0])
+		for i in range(3): y[i] += v[i]
+	for k, v in x['machines'].items():
+		m = machines.setdefault(k, {})
+		for s, t in v.items():
+			y = m.setdefault(s, [0.0, 0.0])
+			y[0] += t[0]
+			y[1] += t[1]
+	for k, v in x['counters'].items(): count(k, v)
+	for k, v in x['profiles'].items(): _add_stats(k, _Stats(v))
+
+
+def report():
+	wall = time.perf_counter() - _start[0]
+	cpu = time.process_time() - _start[1]
+
+	data = {
+		'script': script,
+		'argv': sys.argv[1:],
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'wall': wall,
+		'cpu': cpu,
+		'counters': counters,
+		'stages': { k: { 'wall': v[0], 'cpu': v[1], 'calls': v[2] } for k, v in stages.items() },
+		'machines': { m: { k: { 'wall': v[0], 'cpu': v[1] } for k, v in x.items() } for m, x in machines.items() },
+	}
+	with open(path, "w") as f:
+		json.dump(data, f, indent="\t", sort_keys=True)
+		f.write("\n")
+
+	for k, prof in _profiles.items():
+		prof.create_stats()
+		_add_stats(k, prof)
+	for k, x in _merged.items():
+		x.dump_stats(os.path.join(profile_dir, "{}-{}.prof".format(script, k)))
+
+	print()
+	print("{:<24} {:>9} {:>9} {:>7}".format("stage", "wall", "cpu", "calls"))
+	for k, v in sorted(stages.items(), key=lambda x: -x[1][0])[:top]:
+		print("{:<24} {:>8.2f}s {:>8.2f}s {:>7}".format(k, v[0], v[1], v[2]))
+
+	if machines:
+		print()
+		print("{:<24} {:>9} {:>9}  slowest stage".format("machine", "wall", "cpu"))
+		rows = sorted(machines.items(), key=lambda x: -x[1].get('total', [0])[0])
+		for m, x in rows[:top]:
+			t = x.get('total', [0.0, 0.0])
+			slow = max((k for k in x if k != 'total'), key=lambda k: x[k][0], default='')
+			print("{:<24} {:>8.2f}s {:>8.2f}s  {}".format(m, t[0], t[1], slow))
+
+	print()
+	for k, v in sorted(counters.items()):
+		print("{:<24} {:>12}".format(k, v))
+	print("{:<24} {:>8.2f}s {:>8.2f}s".format("total", wall, cpu))
+	print("profile: {}".format(path))